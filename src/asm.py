@@ -1,7 +1,16 @@
-import re
+import bisect
+import elf
+import emitter
+import hashlib
 import parser
 import lexer
+import nodes
+import opt
+import peep
 import pre
+import regs
+import stats
+import std
 
 '''
 asm.py - the actual compiler
@@ -9,6 +18,19 @@ This module defines functions and objects for compiling parsed Newt code.
 '''
 
 jmps = {'==':'je', '!=':'jne', '<':'jl', '>':'jg', '<=':'jle', '>=':'jge'} # The jump instructions for each condition
+conventions = ['memory', 'registers'] # The calling conventions, each one is a method of Call and Define
+arguments = { # The registers arguments are passed in with the registers convention, in the System V order
+    'byte':['dil', 'sil', 'dl', 'cl', 'r8b', 'r9b'],
+    'word':['di', 'si', 'dx', 'cx', 'r8w', 'r9w'],
+    'dword':['edi', 'esi', 'edx', 'ecx', 'r8d', 'r9d'],
+    'qword':['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9'],
+}
+scratch = {'byte':'al', 'word':'ax', 'dword':'eax', 'qword':'rax'} # The register used for moving values of every type
+sizes = {'byte':1, 'word':2, 'dword':4, 'qword':8} # The size of every type
+types = {size: type for type, size in sizes.items()} # The type of every size
+bulk = 64 # Arrays of at most this many bytes are filled and copied with moves, bigger ones with rep stos and movs
+strings = {1:'b', 2:'w', 4:'d', 8:'q'} # The suffix of the string instructions for every size
+widens = {'movzx', 'movsx', 'movsxd'} # Instructions whose operands have different sizes, so memory ones keep theirs
 
 class Env():
     '''
@@ -18,8 +40,30 @@ class Env():
     def __init__(self, file):
         self.file = file # The input file
         self.vars = {} # Variables dictionary with types
+        self.arrays = {} # The number of elements of every array, their types are in vars
+        self.written = set() # The variables the code may change, strings that are not shared
+        self.terminated = set() # The strings that must end with a 0
         self.funcs = {} # Functions dictionary with arguments
-        self.pos = 0 # Program counter
+        self.labels = {} # The ids of the statements gotos go to, to their labels
+        self.targets = {} # The lines gotos go to, to the labels of the statements there
+        self.fragments = None # Code of statements from the last compile, used for incremental compiles
+        self.used = {} # Code of the statements of this compile
+        self.reused = 0 # Number of statements whose code was reused
+        self.compiled = 0 # Number of statements that were compiled, because their code could not be reused
+        self.numbers = None # The source line of every line that is not empty, for errors
+        self.passes = [] # The peephole optimizer passes to run
+        self.allocate = False # Whether to keep variables in registers in loops
+        self.fold = False # Whether to fold the values of variables known when compiling
+        self.prune = False # Whether to remove the code that does nothing
+        self.convention = 'memory' # How arguments are passed to defined functions, a key of conventions
+        self.frame = {} # The addresses of the local variables of the function we are in
+        self.unroll = 0 # The most statements an unrolled for loop may have
+        self.inline = None # The most statements an inlined function may have, None to inline nothing
+        self.alloc = {} # The registers the loops keep variables in
+        self.regs = {} # The variables in registers right now
+        self.out = [] # The code, as instruction objects, it is written to the file when we are done
+        self.buffer = 0 # Write the code when this many instructions are waiting, if it is not optimized
+        self.profile = None # The profile the times and counts of the compile are added to, if it is measured
         self.indent = 1 # Output indentation level
         self.write('section .text', False) # The text section, store code here
         self.write('global _start')
@@ -32,42 +76,378 @@ class Env():
     def run(self, file):
         '''
         The run method.
-        Iterate over every line in the file, lex, parse, and run it.
-        '''
-        code = pre.pre(file.read()) # Preprocess the input code
-        lines = code.split('\n') # Split the code into lines
-        self.lines = lines # Store the lines so functions can access them
-        while '' in lines:
-            lines.remove('') # Remove empty lines
-        while self.pos < len(lines):
-            line = lines[self.pos] # Get the current line
-            stream = lexer.lex(line) # Lex the line
-            if parser.end(line): # The line is a } (used for ending statements), so we should skip it
-                self.pos += 1
-                continue
-            elif stream:
-                func, stream = parser.parse(stream) # Parse the lexed stream
-                stream = [token[0] for token in stream] # We don't need the tag part of the stream, only the text
-                func = mapping[func](stream)
-                func.run(self) # Run the function we got
+        Preprocess, lex and parse the file, then generate code for it.
+        '''
+        context = pre.Context()
+        code = pre.stream(file.read(), context, file.name) # Preprocess the input code, the lexer reads the lines as they come
+        if self.profile: # Preprocess first, so the stages are measured on their own
+            code = self.profile.stage('pre', list, code)
+            self.profile.count('files', 1)
+            self.profile.count('lines', len(code))
+        tokens = stats.stage(self.profile, 'lex', lexer.Buffer, code) # Lex the whole file once
+        if self.profile:
+            self.profile.count('tokens', len(tokens.text))
+        tree = stats.stage(self.profile, 'parse', parser.program, tokens)
+        self.numbers = tokens.numbers
+        self.deps = context.graph # The files we included
+        stats.stage(self.profile, 'codegen', self.emit, tree)
+    def emit(self, tree):
+        '''
+        The emit method.
+        Generate code for a syntax tree and the library functions it calls, then write the variables.
+        '''
+        tree, library, defines = stats.stage(self.profile, 'link', std.link, tree)
+        self.written = opt.written(tree + defines, std.readers)
+        self.terminated = std.terminated(tree + defines)
+        for node in library: # Library variables are only declared, no code sets them
+            if isinstance(node, nodes.Array):
+                Array(node).run(self)
+            else:
+                self.vars[node.name] = (node.type, node.value if node.value[:1] == '"' else '0')
+        for node in defines: # The library functions come after the code, but it can call them
+            self.funcs[node.name] = node.args
+        self.check(tree)
+        if self.inline is not None: # Put the code of small functions in place of their calls
+            tree = stats.stage(self.profile, 'optimize', opt.inline, tree, self.inline, self.convention == 'registers')
+        declared = opt.declarations(tree)
+        if self.fold: # Fold the values of variables known when compiling
+            tree = stats.stage(self.profile, 'optimize', opt.fold, tree, self.unroll)
+        if self.prune: # Remove functions that are never called and variables that are never read
+            tree = stats.stage(self.profile, 'optimize', opt.prune, tree)
+        if self.fold or self.prune: # Keep the variables of code that was removed, if they are still read
+            kept = {node.name for node in opt.declarations(tree)}
+            read = opt.used(tree)[1] if self.prune else None
+            for node in declared:
+                if node.name not in kept and (read is None or node.name in read):
+                    if isinstance(node, nodes.Array): # It only declares the array
+                        Array(node).run(self)
+                    else:
+                        self.vars[node.name] = (node.type, node.value if node.value[:1] == '"' else '0')
+        if self.allocate:
+            self.alloc = stats.stage(self.profile, 'optimize', regs.allocate, tree)
+        end = self.index(tree)
+        if self.labels: # Loops a goto goes into would not have their registers loaded
+            self.alloc = {loop: vars for loop, vars in self.alloc.items()
+                if not any(id(node) in self.labels for node in nodes.walk(loop.body))}
+        for node in tree:
+            if self.fragments is None:
+                self.visit(node)
             else:
-                self.pos += 1
+                self.reuse(node)
+            if self.buffer and not self.passes and len(self.out) >= self.buffer: # Nothing will change it now
+                self.flush()
+        if end:
+            self.write(end + ':')
+        if any(node.name == 'flush' for node in defines): # Write the buffered output before leaving
+            self.write('call flush')
         self.write('ret') # Return from main function, needed to avoid segmenation fault
+        for node in defines:
+            self.visit(node)
+        if self.passes: # Optimize the code, but not the variables
+            self.out = stats.stage(self.profile, 'optimize', peep.optimize, self.out, self.passes)
+        self.data()
+        self.flush()
+    def index(self, tree):
+        '''
+        The index method.
+        Find the lines gotos may go to, and give the first statement on or after each of them a label. A goto to
+        a variable may go to any value the variable is given. Returns the label of the end of the code, if a goto
+        goes past the last statement.
+        '''
+        order = list(nodes.walk(tree)) # Statements in the order of their lines
+        lines = [node.line for node in order]
+        values = {}
+        for node in order:
+            if isinstance(node, nodes.Assign):
+                values.setdefault(node.name, []).append(node.value)
+        end = None
+        for node in order:
+            if not isinstance(node, nodes.Goto):
+                continue
+            for target in values.get(node.target, [node.target]):
+                line = opt.literal(target)
+                if line is None: # Not a line, so the goto will fail if it ever goes there
+                    continue
+                i = bisect.bisect_left(lines, line)
+                if i == len(order): # Past the last statement, so to the end of the code
+                    end = 'l%d' % (lines[-1] + 1)
+                    self.targets[line] = end
+                    continue
+                label = self.labels.setdefault(id(order[i]), 'l%d' % lines[i])
+                self.targets[line] = label
+        return end
+    def data(self):
+        '''
+        The data method.
+        Write the variables. Strings go in the data section, and every string the code never changes is only
+        written once, with the labels of all the variables that have it. Strings the library looks for the end
+        of get a 0 after them. The other variables start at 0, so they only reserve space in the bss section.
+        Variables are written biggest first, so they are all aligned to their size without padding.
+        '''
+        strings = {} # (type, string), and the name if it is not shared, to the variables that have it
+        zeros = [] # (type, name) of the other variables
+        for var, (type, value) in self.vars.items():
+            if value[:1] == '"' and var in self.written: # It may be changed, so it needs its own copy
+                strings[(type, value, var)] = [var]
+            elif value[:1] == '"':
+                strings.setdefault((type, value), []).append(var)
+            else:
+                zeros.append((type, var))
         self.indent = 1
-        self.write('section .data', False) # The data section, store variables here
-        for var in self.vars:
-            type = 'd' + self.vars[var][0][0] # Define a variable of the right type
-            if self.vars[var][1][0] == '"':
-                self.write('%s: %s %s' % (var, type, self.vars[var][1]))
+        if strings:
+            self.write('section .data', False) # The data section, store strings here
+            for key, names in sorted(strings.items(), key=lambda item: -sizes[item[0][0]]):
+                type, value = key[:2]
+                for name in names[:-1]: # The same string, so the same place
+                    self.write(name + ':')
+                end = ', 0' if any(name in self.terminated for name in names) else '' # Ended by a 0, like in C
+                self.write('%s: d%s %s%s' % (names[-1], type[0], value, end))
+        if zeros:
+            self.write('section .bss align=%d' % max(sizes[type] for type, var in zeros), False) # Reserve the rest
+            for type, var in sorted(zeros, key=lambda zero: -sizes[zero[0]]):
+                self.write('%s: res%s %d' % (var, type[0], self.arrays.get(var, 1)))
+    def flush(self):
+        '''
+        The flush method.
+        Write the code we have so far to the file.
+        '''
+        if self.profile:
+            self.profile.count('instructions', len(self.out))
+        stats.stage(self.profile, 'write', emitter.write, self.file, self.out)
+        self.out = []
+    def visit(self, node):
+        '''
+        The visit method.
+        Generate code for a node with its runner. Errors the runner raises get the line of the node, unless a
+        statement in its body already gave them one.
+        '''
+        if id(node) in self.labels: # A goto goes here
+            self.write(self.labels[id(node)] + ':')
+        spilled = self.spill(node)
+        runner = mapping[type(node)](node)
+        try:
+            if self.profile:
+                self.profile.statement(type(runner).__name__, runner.run, self)
             else:
-                self.write('%s: %s 0' % (var, type))
+                runner.run(self)
+        except SyntaxError as e:
+            if hasattr(e, 'line'): # A statement in our body already gave it its line
+                raise
+            raise self.error(e.msg, node) from None
+        self.reload(spilled)
+    def error(self, message, node):
+        '''
+        The error method.
+        Make an error about a statement, with the line of the code it is on.
+        '''
+        line = self.numbers[node.line] if self.numbers and node.line < len(self.numbers) else node.line + 1
+        error = SyntaxError('%s at line %d' % (message, line))
+        error.line = line
+        return error
+    def check(self, tree):
+        '''
+        The check method.
+        Make sure every variable the code sets without a type, or counts with a for loop, is declared somewhere.
+        This is done before optimizing, which could remove the statements that name them.
+        '''
+        declared = set(self.vars) | set(nodes.types(tree))
+        declared.update(node.name for node in nodes.walk(tree) if isinstance(node, nodes.Array))
+        for node in nodes.walk(tree):
+            if isinstance(node, nodes.Assign) and not node.type and not nodes.element(node.name):
+                name = node.name
+            elif isinstance(node, nodes.For):
+                name = node.var
+            else:
+                continue
+            if name not in declared:
+                raise self.error('Unknown variable %s' % name, node)
+    def fingerprint(self, node):
+        '''
+        The fingerprint method.
+        Get the key of a statement for incremental compiles, and the names it uses. The code of a statement
+        only depends on the statement itself, the variables and functions it names, the label counters, the
+        labels of gotos and the indentation, so they are all in the key.
+        '''
+        names = sorted(set(nodes.words(node)))
+        state = (nodes.key(node), self.ifs, self.loops, self.indent, self.convention, sorted(self.regs.items()),
+            [sorted(self.alloc[n].items()) for n in nodes.walk([node]) if n in self.alloc],
+            [self.labels[id(n)] for n in nodes.walk([node]) if id(n) in self.labels],
+            sorted(self.targets.items()) if any(isinstance(n, nodes.Goto) for n in nodes.walk([node])) else None,
+            [(name, self.vars.get(name), self.funcs.get(name), self.arrays.get(name)) for name in names])
+        return hashlib.sha1(repr(state).encode()).hexdigest(), names
+    def reuse(self, node):
+        '''
+        The reuse method.
+        Generate code for a top-level statement, reusing its code from the last compile if nothing it depends on
+        changed. The changes it makes to the variables and functions are recorded too.
+        '''
+        key, names = self.fingerprint(node)
+        fragment = self.fragments.get(key)
+        if fragment:
+            lines, new, changes, self.ifs, self.loops = fragment
+            self.reused += 1
+            self.out.extend(lines)
+            for name in new: # Add new variables in the same order as before, so the data section is the same
+                self.vars[name] = None
+            for name, var, func, array in changes:
+                if var is not None:
+                    self.vars[name] = var
+                if func is not None:
+                    self.funcs[name] = func
+                if array is not None:
+                    self.arrays[name] = array
+        else:
+            self.compiled += 1
+            count = len(self.vars)
+            start = len(self.out)
+            self.visit(node)
+            lines = self.out[start:]
+            new = list(self.vars)[count:] if len(self.vars) != count else []
+            changes = [(name, self.vars.get(name), self.funcs.get(name), self.arrays.get(name)) for name in names]
+            fragment = (lines, new, changes, self.ifs, self.loops)
+        self.used[key] = fragment
+    def operand(self, name, sized=True):
+        '''
+        The operand method.
+        Get the operand for the value of a variable: its register if it is in one, or its address in brackets.
+        '''
+        if name in self.regs:
+            return self.regs[name]
+        if sized:
+            return '%s [%s]' % (self.vars[name][0], self.address(name))
+        return '[%s]' % self.address(name)
+    def element(self, word, sized=True, into='esi'):
+        '''
+        The element method.
+        Get the operand for an element of an array. Constant indexes are added to the address, variable ones are
+        used from their register, or loaded into the dword register into.
+        '''
+        name, index = nodes.element(word)
+        if name not in self.arrays:
+            raise SyntaxError('%s is not an array' % name)
+        type = self.vars[name][0]
+        size = sizes[type]
+        number = opt.literal(index)
+        if number is not None:
+            if not 0 <= number < self.arrays[name]:
+                raise SyntaxError('Index %s is outside of %s' % (index, name))
+            address = '%s+%d' % (name, number * size) if number else name
+        elif index in self.vars:
+            kind = self.vars[index][0]
+            reg = self.regs.get(index)
+            if reg is None or kind != 'dword': # Get the index into a register, as a dword
+                if kind in ('byte', 'word'):
+                    self.write('movzx %s, %s' % (into, reg or self.operand(index)))
+                elif reg: # A qword in a register, its low half
+                    self.write('mov %s, %s' % (into, regs.register(peep.families[reg], 'dword')))
+                else:
+                    self.write('mov %s, dword [%s]' % (into, self.address(index)))
+                reg = into
+            address = '%s+%s*%d' % (name, reg, size) if size != 1 else '%s+%s' % (name, reg)
+        else:
+            raise SyntaxError('Unknown index %s' % index)
+        if sized:
+            return '%s [%s]' % (type, address)
+        return '[%s]' % address
+    def pointer(self, word, type):
+        '''
+        The pointer method.
+        Check if a word is passed to a function argument of a type as its address. Arrays and strings are, if
+        the argument is big enough for an address. Smaller arguments get their first element.
+        '''
+        if sizes[type] < 4:
+            return False
+        return word in self.arrays or word in self.vars and self.vars[word][1][:1] == '"'
+    def value(self, word, sized=True):
+        '''
+        The value method.
+        Get the operand for a word: a variable, an element of an array, or the word itself.
+        '''
+        if word in self.vars:
+            return self.operand(word, sized)
+        if nodes.element(word):
+            return self.element(word, sized)
+        return word
+    def load(self, word, type):
+        '''
+        The load method.
+        Move a variable or an element of an array into the scratch register of a type, zero extending or cutting
+        it to fit. Returns the register.
+        '''
+        if word in self.vars:
+            kind = self.vars[word][0]
+            source = self.operand(word)
+        else:
+            source = self.element(word)
+            kind = source.split()[0]
+        if sizes[kind] < sizes[type]:
+            if kind == 'dword': # Writing a dword register clears the top half
+                self.write('mov eax, %s' % source)
+            else:
+                self.write('movzx %s, %s' % (scratch[type], source))
+        elif sizes[kind] > sizes[type] and source[-1:] == ']': # Read only the low part from memory
+            self.write('mov %s, %s [%s' % (scratch[type], type, source.split('[', 1)[1]))
+        else: # The low part of the whole register
+            self.write('mov %s, %s' % (scratch[kind], source))
+        return scratch[type]
+    def address(self, name):
+        '''
+        The address method.
+        Get the address of a variable: its label, or its place on the stack if it is a local variable.
+        '''
+        return self.frame.get(name, name)
+    def enter(self, loop, skip=None):
+        '''
+        The enter method.
+        Load the variables a loop keeps in registers, except skip, which the loop sets itself. Returns the
+        variables that were loaded.
+        '''
+        loaded = {}
+        for var, family in self.alloc.get(loop, {}).items():
+            if var in self.vars and var not in self.regs: # It must exist, and not be in a register already
+                loaded[var] = regs.register(family, self.vars[var][0])
+                if var != skip:
+                    self.write('mov %s, [%s]' % (loaded[var], self.address(var)))
+        self.regs.update(loaded)
+        return loaded
+    def leave(self, loaded):
+        '''
+        The leave method.
+        Store the variables a loop kept in registers.
+        '''
+        for var in loaded:
+            self.write('mov [%s], %s' % (self.address(var), self.regs.pop(var)))
+    def spill(self, node):
+        '''
+        The spill method.
+        Store the variables in registers before a statement that may change registers. Returns them, so they can
+        be loaded again.
+        '''
+        if not self.regs or not regs.clobbers(node):
+            return {}
+        for var, reg in self.regs.items():
+            self.write('mov [%s], %s' % (self.address(var), reg))
+        return dict(self.regs)
+    def reload(self, spilled):
+        '''
+        The reload method.
+        Load the variables in registers again after a statement that may have changed registers.
+        '''
+        for var, reg in spilled.items():
+            self.write('mov %s, [%s]' % (reg, self.address(var)))
+    def block(self, body):
+        '''
+        The block method.
+        Generate code for the statements in a block.
+        '''
+        for node in body:
+            self.visit(node)
     def write(self, line, t=True):
         '''
         The write function.
-        Write a line to the output file.
+        Add a line to the code.
         '''
-        self.file.write(('\t' * self.indent if t else '') + line) # Write the line
-        self.file.write('\n') # Line break
+        self.out.append(emitter.parse(self.indent if t else 0, line))
 
 class Assign():
     '''
@@ -76,19 +456,33 @@ class Assign():
     Syntax:
     <type> <name> = <value | name>;
     <name> = <value | name>;
+    <name>[<value | name>] = <value | name>;
+    Values may be elements of arrays too. Assigning to a whole array fills it, or copies another array to it.
     '''
-    def __init__(self, stream):
-        if len(stream) == 5: # The statement is of the form <type> <name> = <val>;
-            self.type = stream[0] # The type
-            self.name = stream[1] # The name
-            self.value = stream[3] # The value
-        else: # The statement is of the form <name> = <val>;
-            self.type = None # The type, not known yet
-            self.name = stream[0] # The name
-            self.value = stream[2] # The value
+    def __init__(self, node):
+        self.type = node.type # The type, None if it is not known yet
+        self.name = node.name # The name
+        self.value = node.value # The value
     def run(self, env):
+        if self.name in env.arrays: # The whole array
+            if self.value in env.arrays:
+                return self.copy(env)
+            return self.fill(env)
+        if nodes.element(self.name): # An element of an array
+            array = nodes.element(self.name)[0]
+            if array in env.arrays and (self.value in env.vars or nodes.element(self.value)):
+                # Move it through a register first, loading the index of the value would change the target's
+                self.value = env.load(self.value, env.vars[array][0])
+            env.write('mov %s, %s' % (env.element(self.name), self.value))
+            return
         if not self.type: # We don't know the type, get it from the dictionary
+            if self.name not in env.vars:
+                raise SyntaxError('Unknown variable %s' % self.name)
             self.type = env.vars[self.name][0]
+        if nodes.element(self.value): # We are assigning an element of an array, move it through a register
+            self.value = env.load(self.value, self.type)
+        if self.value in env.vars and env.vars[self.value][0] != self.type: # Of another size, extend or cut it
+            self.value = env.load(self.value, self.type)
         if self.value in env.vars: # We are assigning a variable to another variable
             type = env.vars[self.value][0]
             val = env.vars[self.value][1]
@@ -102,13 +496,78 @@ class Assign():
                 reg = 'eax' # Dword register
             elif type == 'qword':
                 reg = 'rax' # Qword register
-            self.value = '[%s]' % self.value # Get the variable's value, not its address
+            self.value = env.operand(self.value, False) # Get the variable's value, not its address
             env.write('mov %s, %s' % (reg, self.value)) # Move the value to the register
             self.value = reg # Move register to address
         if '"' not in self.value:
-            env.write('mov %s [%s], %s' % (self.type, self.name, self.value)) # Move the value to the name
+            if self.name in env.regs: # The variable is in a register
+                env.write('mov %s, %s' % (env.regs[self.name], self.value))
+            else:
+                env.write('mov %s [%s], %s' % (self.type, env.address(self.name), self.value)) # Move the value to the name
         env.vars[self.name] = (self.type, self.value) # Store the variables type and value
-        env.pos += 1 # Increment the program counter
+    def fill(self, env):
+        '''
+        The fill method.
+        Set every element of an array to a value. Small arrays are filled with moves, four bytes at a time if
+        the value is known, bigger ones with rep stos.
+        '''
+        type = env.vars[self.name][0]
+        size = sizes[type]
+        count = env.arrays[self.name]
+        number = opt.literal(self.value)
+        if number is not None: # Repeat the value to fill whole dwords
+            number &= (1 << 8 * size) - 1
+            pattern = int.from_bytes(number.to_bytes(size, 'little') * (4 // size), 'little') if size < 4 else number
+        if number is not None and size * count <= bulk and size <= 4:
+            offset = 0
+            for unit in (4, 2, 1): # The biggest stores that fit, then the rest
+                while offset + unit <= size * count:
+                    word = types[unit]
+                    env.write('mov %s [%s], %d' % (word, env.address(self.name) + '+%d' % offset if offset else
+                        env.address(self.name), pattern & ((1 << 8 * unit) - 1)))
+                    offset += unit
+            return
+        value = env.load(self.value, type) if number is None else None
+        if size * count <= bulk: # One element at a time, from a register
+            if value is None:
+                env.write('mov %s, %d' % (scratch[type], number))
+                value = scratch[type]
+            for i in range(count):
+                env.write('mov [%s], %s' % ('%s+%d' % (self.name, i * size) if i else self.name, value))
+            return
+        if number is not None and size < 4 and size * count % 4 == 0 or number == 0 and size == 8:
+            value, size, count = None, 4, size * count // 4 # Store dwords of the pattern instead
+            pattern = pattern if number else 0
+        if value is None:
+            env.write('mov %s, %d' % (scratch[types[size]],
+                pattern & ((1 << 8 * size) - 1) if size <= 4 else number))
+        env.write('mov edi, %s' % self.name)
+        env.write('mov ecx, %d' % count)
+        env.write('rep stos%s' % strings[size])
+    def copy(self, env):
+        '''
+        The copy method.
+        Copy an array to another one. Small arrays are copied with moves through a register, four bytes at a
+        time, bigger ones with rep movs.
+        '''
+        type = env.vars[self.name][0]
+        length = sizes[type] * env.arrays[self.name] # The bytes to copy
+        if sizes[env.vars[self.value][0]] * env.arrays[self.value] < length:
+            raise SyntaxError('%s is smaller than %s' % (self.value, self.name))
+        if length <= bulk:
+            offset = 0
+            for unit in (4, 2, 1):
+                reg = scratch[types[unit]]
+                while offset + unit <= length:
+                    env.write('mov %s, [%s]' % (reg, '%s+%d' % (self.value, offset) if offset else self.value))
+                    env.write('mov [%s], %s' % ('%s+%d' % (self.name, offset) if offset else self.name, reg))
+                    offset += unit
+            return
+        unit = 4 if length % 4 == 0 else 2 if length % 2 == 0 else 1 # The widest moves that fit
+        env.write('mov esi, %s' % self.value)
+        env.write('mov edi, %s' % self.name)
+        env.write('mov ecx, %d' % (length // unit))
+        env.write('rep movs%s' % strings[unit])
 
 class Call():
     '''
@@ -117,21 +576,39 @@ class Call():
     Syntax:
     <name> (<args>);
     '''
-    def __init__(self, stream):
-        self.name = stream[0] # The function name to call
-        self.args = stream[2:stream.index(')')] # The arguments
-        while ',' in self.args: # Remove the commas
-            self.args.remove(',')
+    def __init__(self, node):
+        self.name = node.name # The function name to call
+        self.args = list(node.args) # The arguments
+        self.names = node.args # The arguments as they were written
     def run(self, env):
+        if self.name in env.funcs: # We are calling a defined function, its convention passes the arguments
+            if len(self.args) != len(env.funcs[self.name]):
+                raise SyntaxError('%s takes %d arguments, not %d' % (self.name, len(env.funcs[self.name]),
+                    len(self.args)))
+            getattr(self, env.convention)(env)
+            return
+        # Instructions with no register operands need the size of their variables, like inc dword [x]
+        sized = self.name in widens or not any(arg in elf.registers for arg in self.names)
         for i in range(len(self.args)):
             arg = self.args[i]
-            if arg in env.vars: # If an argument is a variable, convert it to its value
-                arg = '[%s]' % arg
+            if arg in env.vars or nodes.element(arg): # If an argument is a variable, convert it to its value
+                arg = env.value(arg, sized)
             self.args[i] = arg
-        if self.name in env.funcs: # We are calling a defined function
-            args = env.funcs[self.name] # Get the arguments needed
-            for i in range(len(args[1::2])): # Each argument is a variable, so we mov to it
-                type, name = (args[i * 2], args[1::2][i])
+        env.write('%s %s' % (self.name, ', '.join(self.args))) # We are calling a x86 instruction, write it
+    def memory(self, env):
+        '''
+        The memory method.
+        Call a defined function, passing the arguments in its argument variables. Every argument is converted
+        right before it is passed, so the index of an element is loaded just before it is used.
+        '''
+        args = env.funcs[self.name] # Get the arguments needed
+        for i in range(len(self.args)): # Each argument is a variable, so we mov to it
+            arg = self.args[i] # Actual argument
+            type, want = args[i] # The needed argument
+            if env.pointer(arg, type): # Passed as its address
+                pass
+            elif arg in env.vars or nodes.element(arg): # If an argument is a variable, convert it to its value
+                arg = env.value(arg, False)
             # Move the value into a register, then into the argument
             if type == 'byte':
                 reg = 'al' # Byte register
@@ -141,15 +618,36 @@ class Call():
                 reg = 'eax' # Dword register
             elif type == 'qword':
                 reg = 'rax' # Qword register
-            for i in range(len(self.args)):
-                arg = self.args[i] # Actual argument
-                want = args[1::2][i] # The needed argument
-                env.write('mov %s, %s' % (reg, arg)) # Move the value to the register
-                env.write('mov [%s], %s' % (want, reg)) # Move the register to the argument
-            env.write('call %s' % self.name)
-        else: # We are calling a x86 instruction
-            env.write('%s %s' % (self.name, ', '.join(self.args))) # Write the instruction
-        env.pos += 1
+            env.write('mov %s, %s' % (reg, arg)) # Move the value to the register
+            env.write('mov [%s], %s' % (want, reg)) # Move the register to the argument
+        env.write('call %s' % self.name)
+    def registers(self, env):
+        '''
+        The registers method.
+        Call a defined function, passing the arguments in registers and the ones that do not fit on the stack.
+        Variables kept in registers were stored before the call, so they are read from memory. Indexes of
+        elements are loaded into r10d, since esi may already hold an argument.
+        '''
+        extra = [] # The arguments passed on the stack
+        held, env.regs = env.regs, {} # The registers may be arguments by now
+        for i, (arg, (type, want)) in enumerate(zip(self.names, env.funcs[self.name])):
+            if env.pointer(arg, type): # Passed as its address
+                pass
+            elif arg in env.vars:
+                arg = '[%s]' % env.address(arg)
+            elif nodes.element(arg):
+                arg = env.element(arg, False, 'r10d')
+            if i < len(arguments[type]):
+                env.write('mov %s, %s' % (arguments[type][i], arg)) # Move the value to its register
+            else:
+                extra.append((type, arg))
+        env.regs = held
+        for type, arg in reversed(extra): # Push them in reverse, so the first one is on top
+            env.write('mov %s, %s' % (scratch[type], arg))
+            env.write('push rax')
+        env.write('call %s' % self.name)
+        if extra:
+            env.write('add rsp, %d' % (8 * len(extra))) # Remove them from the stack
 
 class Condition():
     '''
@@ -160,15 +658,17 @@ class Condition():
         <code>
     }
     '''
-    def __init__(self, stream):
-        self.a = stream[2] # The first value
-        self.op = stream[3] # The operator
-        self.b = stream[4] # The second value
+    def __init__(self, node):
+        self.a = node.a # The first value
+        self.op = node.op # The operator
+        self.b = node.b # The second value
+        self.body = node.body # The code in the statement
     def run(self, env):
-        if self.a in env.vars: # A is a variable, get its value
-            self.a = '%s [%s]' % (env.vars[self.a][0], self.a)
+        if nodes.element(self.b): # B is an element of an array, compare with a register
+            self.b = env.load(self.b, env.element(self.b).split()[0])
+        self.a = env.value(self.a) # A may be a variable or an element, get its value
         if self.b in env.vars: # B is a variable, get its value
-            self.b = env.vars[self.b]
+            self.b = env.vars[self.b][1]
         self.name = 'i%d:' % env.ifs # Get the name for our label
         env.ifs += 1 # Increment the number of labels
         env.write('cmp %s, %s' % (self.a, self.b)) # Compare our two values
@@ -176,23 +676,7 @@ class Condition():
         env.write('jmp ' + self.name.rstrip(':') + 'e') # Jump over our label
         env.write(self.name) # Create our label
         env.indent += 1 # Indent
-        env.pos += 1
-        level = 1 # The bracket level
-        while level != 0:
-            if parser.end(env.lines[env.pos]): # We just ended a statement, so decrement the bracket level
-                level -= 1
-            else:
-                stream = lexer.lex(env.lines[env.pos]) # Lex the current line
-                func, stream = parser.parse(stream) # Parse it
-                stream = [token[0] for token in stream] # Remove the tag
-                func = mapping[func](stream)
-                func.run(env) # Run it, this causes stuff to be written to the file
-                env.pos -= 1
-            if '{' in env.lines[env.pos]: # We began a statement, so increment the bracket level
-                level += 1
-            if level == 0:
-                env.pos += 1
-                break
+        env.block(self.body) # Run our code, this causes stuff to be written to the file
         env.indent -= 1
         env.write(self.name.rstrip(':') + 'e:') # The label used to jump over our label
         env.indent += 1
@@ -208,17 +692,11 @@ class Asm():
         <assembly>
     }
     '''
-    def __init__(self, stream):
-        pass # We don't need anything from the stream
+    def __init__(self, node):
+        self.body = node.body # The lines of assembly
     def run(self, env):
-        env.pos += 1
-        for i in range(env.pos, len(env.lines)):
-            if parser.end(env.lines[i]): # The statement ended
-                env.pos = i + 1
-                return
-            else:
-                if '}' not in env.lines[i]: #  Write the current line directly to the file
-                    env.write(env.lines[i].strip())
+        for line in self.body: # Write every line directly to the file
+            env.write(line)
 
 class While():
     '''
@@ -229,41 +707,30 @@ class While():
         <code>
     }
     '''
-    def __init__(self, stream):
-        self.a = stream[2] # The a value
+    def __init__(self, node):
+        self.a = node.a # The a value
         self.a2 = self.a
-        self.op = stream[3] # The operator
-        self.b = stream[4] # The b value
+        self.op = node.op # The operator
+        self.b = node.b # The b value
+        self.body = node.body # The code in the loop
+        self.node = node
     def run(self, env):
         if self.b in env.vars:
             self.b = env.vars[self.b][1] # B is a variable, get its value
         eval = 0
+        loaded = env.enter(self.node) # Load the variables we keep in registers
         self.name = 'w%d:' % env.loops # The name of our loop
         env.loops += 1 # Increment the number of loops
         env.write(self.name) # Add our label
         env.indent += 1
-        env.pos += 1
-        level = 1 # The bracket level
-        while level != 0: # While the statement is not over
-            if parser.end(env.lines[env.pos]): # A statement ended, so decrement the bracket level
-                level -= 1
-            else:
-                stream = lexer.lex(env.lines[env.pos]) # Lex the current line
-                func, stream = parser.parse(stream) # Parse it
-                stream = [token[0] for token in stream] # Remove the tags
-                func = mapping[func](stream)
-                func.run(env) # Run it, this adds stuff to the file
-                env.pos -= 1
-            if '{' in env.lines[env.pos]: # A statement began, so increment the bracket level
-                level += 1
-            if level == 0:
-                env.pos += 1
-                break
-        if self.a2 in env.vars: # A is a variable, so take its value
-            self.a2 = '%s [%s]' % (env.vars[self.a2][0], self.a2)
+        env.block(self.body) # Run our code, this adds stuff to the file
+        if nodes.element(self.b): # B is an element of an array, compare with a register
+            self.b = env.load(self.b, env.element(self.b).split()[0])
+        self.a2 = env.value(self.a2) # A may be a variable or an element, so take its value
         env.write('cmp %s, %s' % (self.a2, self.b)) # Compare the a and b values
         env.write(jmps[self.op] + ' ' + self.name.rstrip(':')) # Jump to our loop
         env.indent -= 1
+        env.leave(loaded) # Store the variables we kept in registers
 
 class For():
     '''
@@ -274,40 +741,46 @@ class For():
         <code>
     }
     '''
-    def __init__(self, stream):
-        self.var = stream[2] # The counter variable
-        self.min = stream[4] # The minimum
-        self.max = stream[6] # The maximum
+    def __init__(self, node):
+        self.var = node.var # The counter variable
+        self.min = node.min # The minimum
+        self.max = node.max # The maximum
+        self.body = node.body # The code in the loop
+        self.node = node
     def run(self, env):
-        self.var = '%s [%s]' % (env.vars[self.var][0], self.var) # Make sure we take the value, not the address, of our variable
+        if self.var not in env.vars:
+            raise SyntaxError('Unknown variable %s' % self.var)
+        loaded = env.enter(self.node, self.var) # Load the variables we keep in registers
+        self.var = env.operand(self.var) # Make sure we take the value, not the address, of our variable
         self.name = 'f%d:' % env.loops # The name of our loop
         env.loops += 1
         env.write('mov %s, %s' % (self.var, self.min)) # Set the variable to our minimum
         env.write(self.name) # Add our label
         env.indent += 1
-        env.pos += 1
-        level = 1 # The bracket level
-        while level != 0: # While the statement is still going
-            if parser.end(env.lines[env.pos]): # A statement ended, decrement the bracket level
-                level -= 1
-            else:
-                start = '{' in env.lines[env.pos] # Check whether a statement has started
-                stream = lexer.lex(env.lines[env.pos]) # Lex the current line
-                func, stream = parser.parse(stream) # Parse it
-                stream = [token[0] for token in stream] # Remove the tags
-                func = mapping[func](stream)
-                func.run(env) # Run the function, this adds stuff to the file
-                if start:
-                    env.pos -= 1
-            if '{' in env.lines[env.pos]: # A statement ended, increment the bracket level
-                level += 1
-            if level == 0:
-                env.pos += 1
-                break
+        env.block(self.body) # Run our code, this adds stuff to the file
         env.write('inc %s' % self.var) # Increment our variable
         env.write('cmp %s, %s' % (self.var, self.max)) # Compare it to the max
         env.write('jl ' + self.name.rstrip(':')) # If it is less than it, jump back to our loop
         env.indent -= 1
+        env.leave(loaded) # Store the variables we kept in registers
+
+class Array():
+    '''
+    Array object.
+    Called when an array is declared. The elements start at zero, and are kept with the other variables.
+    Syntax:
+    <type> <name>[<size>];
+    '''
+    def __init__(self, node):
+        self.type = node.type # The type of the elements
+        self.name = node.name # The name
+        self.size = node.size # The number of elements
+    def run(self, env):
+        count = opt.literal(self.size)
+        if count is None or count < 1:
+            raise SyntaxError('Bad size %s for %s' % (self.size, self.name))
+        env.vars[self.name] = (self.type, '0')
+        env.arrays[self.name] = count
 
 class Goto():
     '''
@@ -316,66 +789,114 @@ class Goto():
     Syntax:
     goto <line | name>;
     '''
-    def __init__(self, stream):
-        self.line = stream[1] # The line to jump to
+    def __init__(self, node):
+        self.line = node.target # The line to jump to
     def run(self, env):
         if self.line in env.vars: # The line is a variable, take its value
             self.line = env.vars[self.line][1]
-        self.line = int(self.line, base=10 + (6 * self.line[0:2] == '0x')) # Jump to the line, which might be in hex
-        env.pos = self.line
+        line = opt.literal(self.line) # The line might be in hex
+        if line not in env.targets:
+            raise SyntaxError('Cannot goto %s' % self.line)
+        for var, reg in env.regs.items(): # Store the variables in registers, the code there expects them in memory
+            env.write('mov [%s], %s' % (env.address(var), reg))
+        env.write('jmp ' + env.targets[line]) # Jump to the label of the line
 
 class Define():
     '''
     Define object.
     Called when a function definition is parsed.
     Syntax:
-    define <name> (<type> <name>, ...) {
+    define [inline] <name> (<type> <name>, ...) {
         <code>
     }
     '''
-    def __init__(self, stream):
-        self.name = stream[1] # The name of our function
-        self.args = stream[3:stream.index(')')] # The arguments
-        while ',' in self.args: # Remove commas
-            self.args.remove(',')
+    def __init__(self, node):
+        self.name = node.name # The name of our function
+        self.args = node.args # The (type, name) arguments
+        self.body = node.body # The code in the function
     def run(self, env):
-        for i in range(len(self.args[1::2])): # Initialize all our variables
-            env.vars[self.args[1::2][i]] = (self.args[i * 2], '0')
+        getattr(self, env.convention)(env)
+    def memory(self, env):
+        '''
+        The memory method.
+        Define a function whose arguments are variables in the data section.
+        '''
+        for type, name in self.args: # Initialize all our variables
+            env.vars[name] = (type, '0')
         env.funcs[self.name] = self.args # Put our function in the dictionary
         env.write('jmp e%s' % self.name) # Jump over our function until it is called
         env.write('%s:' % self.name) # Add our label
         env.indent += 1
-        env.pos += 1
-        level = 1 # The bracket level
-        while level != 0:
-            if parser.end(env.lines[env.pos]): # A statement ended, decrement the bracket level
-                level -= 1
-            else:
-                start = '{' in env.lines[env.pos] # Check if a statement started
-                stream = lexer.lex(env.lines[env.pos]) # Lex the current line
-                func, stream = parser.parse(stream) # Parse it
-                stream = [token[0] for token in stream] # Remove the tags
-                func = mapping[func](stream)
-                func.run(env) # Run the function, this adds stuff to the file
-            if '{' in env.lines[env.pos]: # A statement began, increment the bracket level
-                level += 1
-            if level == 0:
-                env.pos += 1
-                break
+        env.block(self.body) # Run our code, this adds stuff to the file
+        env.write('ret') # Return
+        env.indent -= 1
+        env.write('e%s:' % self.name) # Label used to jump over our function
+        env.indent += 1
+        env.write('nop') # Do nothing
+        env.indent -= 1
+    def locals(self, env):
+        '''
+        The locals method.
+        Find the places of the arguments and local variables on the stack. Variables first given a type in our
+        code are local, unless they already exist or are strings. Returns the addresses and the frame size.
+        '''
+        slots = list(self.args[:len(arguments['byte'])]) # The arguments passed in registers are stored here
+        names = {name for type, name in self.args}
+        for node in nodes.walk(self.body):
+            if isinstance(node, nodes.Assign) and node.type and node.value[:1] != '"':
+                if node.name not in env.vars and node.name not in names:
+                    slots.append((node.type, node.name))
+                    names.add(node.name)
+        frame = {}
+        size = 0
+        for type, name in slots:
+            size = (size + sizes[type] + sizes[type] - 1) // sizes[type] * sizes[type] # Align it naturally
+            frame[name] = 'rbp-%d' % size
+        for i, (type, name) in enumerate(self.args[len(arguments['byte']):]): # The caller pushed the rest
+            frame[name] = 'rbp+%d' % (16 + 8 * i)
+        return frame, (size + 15) // 16 * 16 # Keep the stack aligned
+    def registers(self, env):
+        '''
+        The registers method.
+        Define a function whose arguments are passed in registers, and whose variables live on the stack, so it
+        can call itself.
+        '''
+        frame, size = self.locals(env)
+        outer = (env.frame, {name: env.vars[name] for name in frame if name in env.vars})
+        env.frame = frame
+        for type, name in self.args: # Initialize all our variables
+            env.vars[name] = (type, '0')
+        env.funcs[self.name] = self.args # Put our function in the dictionary
+        env.write('jmp e%s' % self.name) # Jump over our function until it is called
+        env.write('%s:' % self.name) # Add our label
+        env.indent += 1
+        env.write('push rbp') # The prologue, make our stack frame
+        env.write('mov rbp, rsp')
+        if size:
+            env.write('sub rsp, %d' % size)
+        for i, (type, name) in enumerate(self.args[:len(arguments['byte'])]): # Store the arguments in the frame
+            env.write('mov [%s], %s' % (frame[name], arguments[type][i]))
+        env.block(self.body) # Run our code, this adds stuff to the file
+        env.write('leave') # The epilogue, remove our stack frame
         env.write('ret') # Return
         env.indent -= 1
         env.write('e%s:' % self.name) # Label used to jump over our function
         env.indent += 1
         env.write('nop') # Do nothing
         env.indent -= 1
+        env.frame, shadowed = outer
+        for name in frame: # Our variables do not exist outside of us
+            env.vars.pop(name, None)
+        env.vars.update(shadowed)
 
-mapping = { # Map parsing functions to runner objects
-    parser.assign:Assign,
-    parser.call:Call,
-    parser.condition:Condition,
-    parser.asm:Asm,
-    parser.loop:While,
-    parser.rep:For,
-    parser.goto:Goto,
-    parser.define:Define
+mapping = { # Map nodes to runner objects
+    nodes.Assign:Assign,
+    nodes.Call:Call,
+    nodes.Condition:Condition,
+    nodes.Asm:Asm,
+    nodes.While:While,
+    nodes.For:For,
+    nodes.Array:Array,
+    nodes.Goto:Goto,
+    nodes.Define:Define
 }
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+import argparse
+import asm
+import io
+import json
+import lexer
+import os
+import parser
+import platform
+import pre
+import sys
+import tempfile
+import time
+import tracemalloc
+
+'''
+bench.py - compiler benchmarks
+This module makes Newt programs of any size, compiles them one stage at a time, and reports how long every stage
+took, how many lines it went through per second and how much memory it used at most. Results can be saved as
+JSON baselines, and later runs compared with them to find stages that got slower.
+'''
+
+types = ['byte', 'word', 'dword', 'qword']
+stages = ['pre', 'lex', 'parse', 'codegen'] # The stages, in the order they run
+
+def name(prefix, i):
+    '''
+    name function.
+    Used for making the i-th name with a prefix. Newt names are only letters, so the number is written in them.
+    '''
+    letters = ''
+    while True:
+        letters = chr(ord('a') + i % 26) + letters
+        i //= 26
+        if not i:
+            return prefix + letters
+
+def assignments(n):
+    '''
+    assignments function.
+    Used for making a program with n assignments, half of them from other variables.
+    '''
+    lines = []
+    for i in range(n):
+        if i % 2 and i > 4: # From a variable of the same type
+            lines.append('%s = %s;' % (name('v', i - 1), name('v', i - 5)))
+        else:
+            lines.append('%s %s = %d;' % (types[i % 4], name('v', i), i % 100))
+    return {'main.newt': '\n'.join(lines)}
+
+def nesting(n):
+    '''
+    nesting function.
+    Used for making a program with if statements, while loops and for loops nested n deep, repeated n times.
+    '''
+    lines = ['dword a = 1;', 'dword b = 2;', 'dword i = 0;']
+    for repeat in range(n):
+        for depth in range(n):
+            kind = depth % 3
+            if kind == 0:
+                lines.append('    ' * depth + 'if (a == %d) {' % depth)
+            elif kind == 1:
+                lines.append('    ' * depth + 'while (b < %d) {' % (depth + 10))
+            else:
+                lines.append('    ' * depth + 'for (i, 0, %d) {' % (depth + 2))
+            lines.append('    ' * (depth + 1) + 'inc(b);')
+            lines.append('    ' * (depth + 1) + 'a = %d;' % depth)
+        for depth in reversed(range(n)):
+            lines.append('    ' * depth + '}')
+    return {'main.newt': '\n'.join(lines)}
+
+def functions(n):
+    '''
+    functions function.
+    Used for making a program with n functions, each called twice.
+    '''
+    lines = ['dword total = 0;']
+    for i in range(n):
+        lines.append('define %s(dword %s, byte %s) {' % (name('k', i), name('x', i), name('y', i)))
+        lines.append('    add(total, %s);' % name('x', i))
+        lines.append('    mov(eax, %s);' % name('x', i))
+        lines.append('}')
+    for i in range(n):
+        lines.append('%s(%d, 1);' % (name('k', i), i))
+        lines.append('%s(total, 2);' % name('k', i))
+    return {'main.newt': '\n'.join(lines)}
+
+def macros(n):
+    '''
+    macros function.
+    Used for making a program with n @defines, each used once.
+    '''
+    lines = ['@define %s %d;' % (name('M', i), i) for i in range(n)]
+    lines += ['dword %s = %s;' % (name('m', i), name('M', i)) for i in range(n)]
+    return {'main.newt': '\n'.join(lines)}
+
+def includes(n):
+    '''
+    includes function.
+    Used for making a chain of n files, each including the next one.
+    '''
+    files = {}
+    for i in range(n):
+        file = 'main.newt' if i == 0 else 'inc%d.newt' % i
+        lines = ['@include inc%d.newt;' % (i + 1)] if i + 1 < n else []
+        lines += ['dword %s = %d;' % (name(name('c', i) + '_', j), j) for j in range(10)]
+        files[file] = '\n'.join(lines)
+    return files
+
+benchmarks = { # Benchmark names to their program makers and their default sizes
+    'assign':(assignments, 20000),
+    'nest':(nesting, 40),
+    'define':(functions, 2000),
+    'macro':(macros, 2000),
+    'include':(includes, 200),
+}
+
+def compile(path, measure):
+    '''
+    compile function.
+    Used for compiling a file one stage at a time. measure is called with every stage's name and function, and
+    returns what the stage returned. Returns the number of preprocessed lines.
+    '''
+    with open(path) as file:
+        code = file.read()
+    lines = measure('pre', lambda: list(pre.stream(code, pre.Context(), path)))
+    tokens = measure('lex', lambda: lexer.Buffer(lines))
+    tree = measure('parse', lambda: parser.program(tokens))
+    measure('codegen', lambda: asm.Env(io.StringIO()).emit(tree))
+    return len(lines)
+
+def run(path, repeat):
+    '''
+    run function.
+    Used for benchmarking a file. Every stage is timed repeat times, and the fastest time is kept. The memory is
+    measured in another run, since tracing memory makes the code slower.
+    '''
+    seconds = {stage: float('inf') for stage in stages}
+    def timed(stage, function):
+        start = time.perf_counter()
+        value = function()
+        seconds[stage] = min(seconds[stage], time.perf_counter() - start)
+        return value
+    for i in range(repeat):
+        pre.files.clear() # Read the files every time
+        lines = compile(path, timed)
+    peaks = {}
+    def traced(stage, function):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        value = function()
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - before
+        return value
+    tracemalloc.start()
+    try:
+        compile(path, traced)
+    finally:
+        tracemalloc.stop()
+    result = {'lines':lines, 'stages':{}}
+    for stage in stages:
+        result['stages'][stage] = {
+            'seconds':seconds[stage],
+            'lines_per_sec':lines / seconds[stage] if seconds[stage] else 0,
+            'peak_kb':peaks[stage] / 1024,
+        }
+    total = sum(seconds.values())
+    result['total'] = {'seconds':total, 'lines_per_sec':lines / total if total else 0}
+    return result
+
+def benchmark(name, scale, repeat):
+    '''
+    benchmark function.
+    Used for making the program of a benchmark in a temporary directory and benchmarking it.
+    '''
+    maker, size = benchmarks[name]
+    with tempfile.TemporaryDirectory() as temp:
+        for file, text in maker(max(1, int(size * scale))).items():
+            with open(os.path.join(temp, file), 'w') as out:
+                out.write(text)
+        return run(os.path.join(temp, 'main.newt'), repeat)
+
+def table(results):
+    '''
+    table function.
+    Used for printing results as a table.
+    '''
+    print('%-10s %8s' % ('benchmark', 'lines') + ''.join('%11s' % stage for stage in stages) +
+        '%11s %12s %10s' % ('total', 'lines/s', 'peak KB'))
+    for name, result in results.items():
+        row = '%-10s %8d' % (name, result['lines'])
+        row += ''.join('%10.4fs' % result['stages'][stage]['seconds'] for stage in stages)
+        peak = max(result['stages'][stage]['peak_kb'] for stage in stages)
+        row += '%10.4fs %12.0f %10.0f' % (result['total']['seconds'], result['total']['lines_per_sec'], peak)
+        print(row)
+
+def compare(results, baseline, tolerance):
+    '''
+    compare function.
+    Used for comparing results with a baseline. A stage that got more than tolerance slower is a regression.
+    Returns the number of regressions.
+    '''
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline['benchmarks']:
+            continue
+        old = baseline['benchmarks'][name]
+        if old['lines'] != result['lines']: # Not the same program, the times say nothing
+            print('%s: the program changed size, not comparing' % name)
+            continue
+        for stage in stages:
+            was = old['stages'][stage]['seconds']
+            now = result['stages'][stage]['seconds']
+            ratio = now / was if was else 1
+            if ratio > 1 + tolerance:
+                regressions += 1
+                print('%s %s: %.4fs -> %.4fs (%.0f%% slower)' % (name, stage, was, now, (ratio - 1) * 100))
+    return regressions
+
+def main():
+    '''
+    main function.
+    Used for running the benchmarks from the command line.
+    '''
+    args = argparse.ArgumentParser(description='Benchmark the Newt compiler.')
+    args.add_argument('names', nargs='*', metavar='benchmark',
+        help='the benchmarks to run: %s (default: all)' % ', '.join(benchmarks))
+    args.add_argument('--scale', type=float, default=1.0, help='multiply the size of every program by this')
+    args.add_argument('--repeat', type=int, default=3, help='run every stage this many times, and keep the fastest')
+    args.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    args.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    args.add_argument('--tolerance', type=float, default=0.25,
+        help='how much slower a stage may get before it is a regression (default: 0.25, 25%%)')
+    parsed = args.parse_args()
+    for name in parsed.names:
+        if name not in benchmarks:
+            args.error('unknown benchmark %r, choose from %s' % (name, ', '.join(benchmarks)))
+    args = parsed
+    results = {name: benchmark(name, args.scale, args.repeat) for name in args.names or benchmarks}
+    table(results)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python':platform.python_version(), 'scale':args.scale, 'benchmarks':results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        print('%d regressions' % regressions)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
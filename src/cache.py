@@ -0,0 +1,177 @@
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import std
+import tempfile
+
+'''
+cache.py - compilation cache
+This module stores compiled assembly on disk, so files that did not change are not compiled again.
+'''
+
+version = '16' # Bump this when the generated code changes, so old entries are not used
+
+def key(lines, options):
+    '''
+    key function.
+    Used for getting the cache key of preprocessed code, compiled with a dictionary of options. The key of the
+    syntax tree, which does not depend on the options, is the key with no options.
+    '''
+    digest = hashlib.sha256()
+    digest.update(version.encode())
+    digest.update(std.digest().encode()) # The library is part of the code
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    for line in lines:
+        digest.update(line.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+class Cache():
+    '''
+    The cache object.
+    Entries are files in a directory, named by their key. When the directory gets bigger than its size limit,
+    the entries used longest ago are removed.
+    '''
+    def __init__(self, path, size=100 * 1024 * 1024):
+        self.path = path # The cache directory
+        self.size = size # The most bytes the entries may use
+        self.hits = 0 # Hits and misses of this run
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+    def __repr__(self):
+        return self.path + ' cache'
+    def file(self, key, ext):
+        '''
+        The file method.
+        Get the path of an entry.
+        '''
+        return os.path.join(self.path, key + ext)
+    def get(self, key):
+        '''
+        The get method.
+        Get the assembly for a key, or None if it is not cached.
+        '''
+        path = self.file(key, '.asm')
+        try:
+            with open(path) as file:
+                text = file.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path) # The entry was used, so it should be removed last
+        self.hits += 1
+        return text
+    def tree(self, key):
+        '''
+        The tree method.
+        Get the syntax tree for a key, or None if it was not stored.
+        '''
+        path = self.file(key, '.ast')
+        try:
+            with open(path, 'rb') as file:
+                tree = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return tree
+    def plant(self, key, tree):
+        '''
+        The plant method.
+        Store the syntax tree for a key.
+        '''
+        self.write(self.file(key, '.ast'), pickle.dumps(tree))
+        self.evict()
+    def put(self, key, text):
+        '''
+        The put method.
+        Store the assembly for a key.
+        '''
+        self.write(self.file(key, '.asm'), text.encode())
+        self.evict()
+    def fragments(self, source):
+        '''
+        The fragments method.
+        Get the code of the statements of a source file from its last compile, for incremental compiles.
+        '''
+        try:
+            with open(self.file(self.name(source), '.frag'), 'rb') as file:
+                return pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return {}
+    def keep(self, source, fragments):
+        '''
+        The keep method.
+        Store the code of the statements of a source file. Only the statements of the last compile are kept.
+        '''
+        self.write(self.file(self.name(source), '.frag'), pickle.dumps(fragments))
+        self.evict()
+    def name(self, source):
+        '''
+        The name method.
+        Get the name of the entry for a source file.
+        '''
+        return hashlib.sha256((version + os.path.abspath(source)).encode()).hexdigest()
+    def write(self, path, data):
+        '''
+        The write method.
+        Write a file so that other processes never see it half written.
+        '''
+        fd, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp, path)
+    def evict(self):
+        '''
+        The evict method.
+        Remove the entries used longest ago until the cache fits in its size.
+        '''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(('.asm', '.ast', '.frag')):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+                total += stat.st_size
+        entries.sort()
+        evicted = 0
+        for mtime, path, size in entries:
+            if total <= self.size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError: # Another process removed it
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self.count(evictions=evicted)
+    def count(self, **counts):
+        '''
+        The count method.
+        Add numbers to the statistics stored in the cache.
+        '''
+        with open(os.path.join(self.path, 'stats.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX) # Other processes may be counting too
+            stats = self.stats()
+            for name in counts:
+                stats[name] = stats.get(name, 0) + counts[name]
+            self.write(os.path.join(self.path, 'stats.json'), json.dumps(stats).encode())
+    def stats(self):
+        '''
+        The stats method.
+        Get the statistics stored in the cache: hits, misses and evictions.
+        '''
+        try:
+            with open(os.path.join(self.path, 'stats.json')) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {'hits':0, 'misses':0, 'evictions':0}
+    def close(self):
+        '''
+        The close method.
+        Store the hits and misses of this run.
+        '''
+        self.count(hits=self.hits, misses=self.misses)
+        self.hits = self.misses = 0
@@ -0,0 +1,145 @@
+import asm
+import cache
+import collections
+import io
+import lexer
+import parser
+import peep
+import pre
+import stats
+import time
+
+'''
+compiler.py - the library interface
+This module compiles Newt code from Python, without files or command line arguments. Every compile gets its own
+state, so many compiles can run in one process, and what is worth keeping between them (the compiled patterns,
+the included files and the compiled code) stays warm.
+'''
+
+defaults = { # The options that change the generated code, and their defaults
+    'O':0, # The optimization level
+    'unroll':0, # Unroll for loops with a known number of runs if they have at most this many statements
+    'inline':4, # Inline functions with at most this many statements, with -O2
+    'disable':[], # Peephole optimizer passes not to run
+    'call':'memory', # How arguments are passed to functions, a key of asm.conventions
+    'buffer':0, # Write the code every this many instructions, if it is not optimized
+}
+errors = (SyntaxError, RecursionError, OSError) # Raised when the code is wrong, or includes a circle or a missing file
+
+class Result():
+    '''
+    The result object.
+    The compiled code, the files that were included, and whether the code came from the cache.
+    '''
+    def __init__(self, code, deps, cached, seconds):
+        self.code = code # The nasm code
+        self.deps = deps # Which files every file includes
+        self.cached = cached # Whether the code was found in the cache
+        self.seconds = seconds # How long the compile took
+    def __repr__(self):
+        return 'Result(%d lines%s)' % (self.code.count('\n'), ', cached' if self.cached else '')
+
+class Memory():
+    '''
+    The memory object.
+    A cache of compiled code kept in memory, like cache.Cache but without files. When it is full, the code used
+    longest ago is dropped.
+    '''
+    def __init__(self, size=256):
+        self.size = size # The most entries to keep
+        self.entries = collections.OrderedDict() # Keys to code, the one used last at the end
+        self.hits = 0
+        self.misses = 0
+    def get(self, key):
+        '''
+        The get method.
+        Get the code stored for a key, or None.
+        '''
+        text = self.entries.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return text
+    def put(self, key, text):
+        '''
+        The put method.
+        Store the code for a key.
+        '''
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+    def stats(self):
+        '''
+        The stats method.
+        Get the number of entries, hits and misses.
+        '''
+        return {'entries':len(self.entries), 'hits':self.hits, 'misses':self.misses}
+
+def settings(options=None):
+    '''
+    settings function.
+    Used for filling in the defaults of a dictionary of options. Raises ValueError for options that do not
+    exist or have a bad value.
+    '''
+    options = dict(defaults, **(options or {}))
+    for name in options:
+        if name not in defaults:
+            raise ValueError('Unknown option %r' % name)
+    if options['O'] not in peep.levels:
+        raise ValueError('Bad optimization level %r' % options['O'])
+    if options['call'] not in asm.conventions:
+        raise ValueError('Bad calling convention %r' % options['call'])
+    for name in options['disable']:
+        if name not in peep.passes:
+            raise ValueError('Unknown optimizer pass %r' % name)
+    return options
+
+def setup(env, options):
+    '''
+    setup function.
+    Used for setting the optimizations of an environment from a dictionary of options.
+    '''
+    env.passes = [name for name in peep.levels[options['O']] if name not in options['disable']]
+    env.fold = options['O'] >= 1 # Fold the values of variables known when compiling
+    env.prune = options['O'] >= 1 # Remove the functions and variables that are never used
+    env.unroll = options['unroll']
+    env.inline = options['inline'] if options['O'] >= 2 else 0 if options['O'] >= 1 else None # Only hinted ones at -O1
+    env.allocate = options['O'] >= 2 # Keep variables in registers in loops
+    env.convention = options['call']
+    env.buffer = options['buffer']
+
+def compile(source, options=None, path=None, store=None, profile=None):
+    '''
+    compile function.
+    Used for compiling Newt code. The path of the code is used for finding included files, relative to the
+    current directory if there is none. If a store like cache.Cache or Memory is given, the code is looked up in
+    it first. If a profile is given, the times and counts of the compile are added to it. Returns a result object.
+    '''
+    start = time.perf_counter()
+    options = settings(options)
+    context = pre.Context()
+    lines = stats.stage(profile, 'pre', list, pre.stream(source, context, path))
+    if profile:
+        profile.count('files', 1)
+        profile.count('lines', len(lines))
+    key = cache.key(lines, options) if store is not None else None
+    text = store.get(key) if key else None
+    if text is not None:
+        return Result(text, context.graph, True, time.perf_counter() - start)
+    tokens = stats.stage(profile, 'lex', lexer.Buffer, lines)
+    if profile:
+        profile.count('tokens', len(tokens.text))
+    tree = stats.stage(profile, 'parse', parser.program, tokens)
+    file = io.StringIO()
+    env = asm.Env(file)
+    setup(env, options)
+    env.profile = profile
+    env.numbers = tokens.numbers
+    stats.stage(profile, 'codegen', env.emit, tree)
+    text = file.getvalue()
+    if key:
+        store.put(key, text)
+    return Result(text, context.graph, False, time.perf_counter() - start)
@@ -0,0 +1,130 @@
+import asyncio
+import concurrent.futures
+import os
+import shlex
+import sys
+import time
+import elf
+import pre
+import std
+
+'''
+driver.py - build driver
+This module compiles, assembles and links many files at once. Every file goes through its steps on its own, so
+files that are compiled can be assembled while the others are still compiling. Compiles run in a pool of
+processes, and the assembler and linker run as subprocesses, at most jobs of them at a time. Steps whose outputs
+are newer than their inputs are skipped.
+'''
+
+assembler = 'nasm -f elf{bits} -o {obj} {asm}' # The default assembler command
+linker = 'ld -m {emulation} -o {exe} {obj}' # The default linker command
+emulations = {32:'elf_i386', 64:'elf_x86_64'} # The ld emulation for 32 and 64 bit code
+
+def stale(output, inputs):
+    '''
+    stale function.
+    Used for checking if a file must be made again: if it does not exist, or an input is newer than it.
+    '''
+    try:
+        made = os.stat(output).st_mtime_ns
+    except FileNotFoundError:
+        return True
+    return any(os.stat(path).st_mtime_ns > made for path in inputs)
+
+def inputs(path):
+    '''
+    inputs function.
+    Used for getting the files the code of a file depends on: the file, everything it includes, and the
+    standard library.
+    '''
+    try:
+        graph = pre.depends(path)
+    except Exception: # It will not compile, so let the compile report why
+        return [path]
+    files = {path} | set(std.paths())
+    for name, included in graph.items():
+        files.add(name)
+        files.update(included)
+    return [name for name in files if os.path.exists(name)]
+
+def command(template, **fields):
+    '''
+    command function.
+    Used for making the arguments of a command from its template.
+    '''
+    return [word.format(**fields) for word in shlex.split(template)]
+
+async def run(args, slots):
+    '''
+    run function.
+    Used for running a command once a slot is free. Raises RuntimeError if it fails.
+    '''
+    async with slots:
+        process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT)
+        output, _ = await process.communicate()
+    if process.returncode:
+        raise RuntimeError('%s failed: %s' % (args[0], output.decode().strip() or 'exit status %d' % process.returncode))
+
+async def target(path, args, pool, slots, compile):
+    '''
+    target function.
+    Used for building the executable of a file. Returns the path, the steps that ran, the time it took and the
+    error, if there was one.
+    '''
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    base = os.path.splitext(path)[0]
+    asm = base + '.asm'
+    obj = base + '.o'
+    steps = []
+    try:
+        if args.force or stale(asm, await loop.run_in_executor(None, inputs, path)):
+            error = (await loop.run_in_executor(pool, compile, path, args))[2]
+            if error: # Already reported with its type
+                return path, steps, time.perf_counter() - start, error
+            steps.append('compiled')
+        if args.assembler == 'builtin': # The built-in assembler makes the executable itself
+            if args.force or stale(base, [asm]):
+                with open(asm) as file:
+                    await loop.run_in_executor(pool, elf.build, file.read(), base)
+                steps.append('assembled and linked')
+        else:
+            with open(asm) as file:
+                bits = elf.bits(file.read())
+            fields = {'asm':asm, 'obj':obj, 'exe':base, 'bits':bits, 'emulation':emulations[bits]}
+            if args.force or stale(obj, [asm]):
+                await run(command(args.assembler, **fields), slots)
+                steps.append('assembled')
+            if args.force or stale(base, [obj]):
+                await run(command(args.linker, **fields), slots)
+                steps.append('linked')
+    except Exception as e: # Report the error with the file, and go on with the others
+        return path, steps, time.perf_counter() - start, '%s: %s' % (type(e).__name__, e)
+    return path, steps, time.perf_counter() - start, None
+
+async def pipeline(files, args, compile):
+    '''
+    pipeline function.
+    Used for building every file at once. Returns the results in the order of the files.
+    '''
+    slots = asyncio.Semaphore(args.jobs) # At most jobs assemblers and linkers at a time
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        return await asyncio.gather(*[target(path, args, pool, slots, compile) for path in files])
+
+def build(files, args, compile):
+    '''
+    build function.
+    Used for building executables from many files. compile is called in worker processes to compile a file,
+    like newt.work. Returns the number of files that failed.
+    '''
+    start = time.perf_counter()
+    failed = 0
+    for path, steps, seconds, error in asyncio.run(pipeline(files, args, compile)):
+        if error:
+            failed += 1
+            print('%s: %s' % (path, error), file=sys.stderr)
+        else:
+            print('%9.3fs  %s: %s' % (seconds, path, ', '.join(steps) or 'up to date'))
+    print('built %d files (%d failed) in %.3fs' % (len(files), failed, time.perf_counter() - start))
+    return failed
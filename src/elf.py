@@ -0,0 +1,502 @@
+import os
+import re
+import struct
+import subprocess
+import tempfile
+
+'''
+elf.py - built-in assembler
+This module turns the assembly Newt generates into a static ELF executable without running nasm and ld. It knows
+the instructions the code generator uses, and a few more that are common in asm blocks. Code that uses anything
+else is assembled and linked with nasm and ld instead.
+'''
+
+bases = {32:0x08048000, 64:0x400000} # The address the executable is loaded at
+page = 0x1000 # Segments start on a new page
+conditions = { # The condition codes of the conditional jumps
+    'o':0, 'no':1, 'b':2, 'c':2, 'nae':2, 'ae':3, 'nb':3, 'nc':3, 'e':4, 'z':4, 'ne':5, 'nz':5,
+    'be':6, 'na':6, 'a':7, 'nbe':7, 's':8, 'ns':9, 'p':10, 'pe':10, 'np':11, 'po':11,
+    'l':12, 'nge':12, 'ge':13, 'nl':13, 'le':14, 'ng':14, 'g':15, 'nle':15,
+}
+alu = {'add':0, 'or':1, 'adc':2, 'sbb':3, 'and':4, 'sub':5, 'xor':6, 'cmp':7} # The /digit of every arithmetic op
+unary = { # The opcode and /digit of every instruction with one operand
+    'inc':(0xfe, 0), 'dec':(0xfe, 1), 'not':(0xf6, 2), 'neg':(0xf6, 3),
+    'mul':(0xf6, 4), 'imul':(0xf6, 5), 'div':(0xf6, 6), 'idiv':(0xf6, 7),
+}
+shifts = {'rol':0, 'ror':1, 'shl':4, 'sal':4, 'shr':5, 'sar':7} # The /digit of every shift
+plain = {'ret':b'\xc3', 'nop':b'\x90', 'leave':b'\xc9', 'syscall':b'\x0f\x05', 'hlt':b'\xf4', 'int3':b'\xcc',
+    'cld':b'\xfc'}
+strings = { # The string instructions rep may repeat, and their opcode and size
+    'stosb':(0xaa, 1), 'stosw':(0xab, 2), 'stosd':(0xab, 4), 'stosq':(0xab, 8),
+    'movsb':(0xa4, 1), 'movsw':(0xa5, 2), 'movsd':(0xa5, 4), 'movsq':(0xa5, 8),
+}
+scales = {1:0, 2:1, 4:2, 8:3} # The SIB bits of every index scale
+data = {'db':1, 'dw':2, 'dd':4, 'dq':8} # The size of every data directive
+reserve = {'resb':1, 'resw':2, 'resd':4, 'resq':8} # The size of every reserve directive
+types = {'byte':1, 'word':2, 'dword':4, 'qword':8} # The size of every operand size keyword
+registers = {} # Register names to (number, size, kind), kind is 'rex' or 'high' for byte registers that need care
+for i, name in enumerate(['al', 'cl', 'dl', 'bl', 'ah', 'ch', 'dh', 'bh']):
+    registers[name] = (i, 1, 'high' if i >= 4 else None)
+for i, name in enumerate(['spl', 'bpl', 'sil', 'dil']):
+    registers[name] = (i + 4, 1, 'rex')
+for i, names in enumerate(zip(['ax', 'cx', 'dx', 'bx', 'sp', 'bp', 'si', 'di'],
+        ['eax', 'ecx', 'edx', 'ebx', 'esp', 'ebp', 'esi', 'edi'], ['rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi'])):
+    for size, name in zip((2, 4, 8), names):
+        registers[name] = (i, size, None)
+for i in range(8, 16):
+    for size, suffix in ((1, 'b'), (2, 'w'), (4, 'd'), (8, '')):
+        registers['r%d%s' % (i, suffix)] = (i, size, None)
+wide = re.compile(r'\b(?:r[abcd]x|r[sd]i|r[sb]p|r\d+[bwd]?|[sd]il|[sb]pl|syscall|stosq|movsq)\b') # Code that needs 64 bits
+line = re.compile(r'([a-zA-Z_.][\w.]*):\s*(.*)$') # A label, and what comes after it
+part = re.compile(r'"[^"]*"|\'[^\']*\'|[^,]+') # An operand, strings may have commas
+comment = re.compile(r'(?:"[^"]*"|\'[^\']*\'|[^;"\'])*') # The code before a comment
+term = re.compile(r'\s*([+-]?)\s*([^+\s-]+)') # A term of an address or value
+
+class Unsupported(Exception):
+    '''
+    The unsupported object.
+    Raised when code uses something the built-in assembler cannot encode.
+    '''
+
+class Operand():
+    '''
+    The operand object.
+    A register, a memory address or an immediate value. Values that use labels are always encoded at full size,
+    so instructions have the same size before and after labels get their addresses.
+    '''
+    __slots__ = ('kind', 'reg', 'size', 'special', 'base', 'index', 'value', 'labelled')
+    def __init__(self, kind, reg=None, size=None, special=None, base=None, index=None, value=0, labelled=False):
+        self.kind = kind # 'reg', 'mem' or 'imm'
+        self.reg = reg # The register number
+        self.size = size # The size in bytes, None if it is not known
+        self.special = special # How a byte register must be encoded
+        self.base = base # The base register of an address, a (number, size) pair
+        self.index = index # The index register of an address, a (number, size, scale) triple
+        self.value = value # The displacement of an address, or the immediate value
+        self.labelled = labelled # Whether the value uses a label
+
+class Assembler():
+    '''
+    The assembler object.
+    Used for assembling code for 32 or 64 bit x86. Labels are looked up in symbols, which is None while the
+    code is being laid out.
+    '''
+    def __init__(self, bits):
+        self.bits = bits # 32 or 64
+        self.symbols = None # Label names to addresses
+        self.scope = '' # The last label that is not local, for .local labels
+    def name(self, label):
+        '''
+        The name method.
+        Get the full name of a label.
+        '''
+        return self.scope + label if label.startswith('.') else label
+    def value(self, text):
+        '''
+        The value method.
+        Get the value of a number, character or label, with + and - terms. Returns the value and whether it
+        uses a label.
+        '''
+        total = 0
+        labelled = False
+        terms = term.findall(text)
+        if not terms or ''.join(sign + word for sign, word in terms) != text.replace(' ', ''):
+            raise Unsupported('Bad value %r' % text)
+        for sign, word in terms:
+            if len(word) == 3 and word[0] == word[2] and word[0] in '\'"':
+                number = ord(word[1])
+            elif word[:1].isdigit():
+                try:
+                    number = int(word, 0) if word[:2] in ('0x', '0b', '0o') else int(word, 10)
+                except ValueError:
+                    raise Unsupported('Bad number %r' % word)
+            elif re.fullmatch(r'[a-zA-Z_.][\w.]*', word):
+                labelled = True
+                if self.symbols is None:
+                    number = 0
+                elif self.name(word) in self.symbols:
+                    number = self.symbols[self.name(word)]
+                else:
+                    raise Unsupported('Unknown label %r' % word)
+            else:
+                raise Unsupported('Bad value %r' % word)
+            total += -number if sign == '-' else number
+        return total, labelled
+    def operand(self, text):
+        '''
+        The operand method.
+        Parse an operand.
+        '''
+        size = None
+        words = text.split(None, 1)
+        if len(words) == 2 and words[0] in types: # An operand size, like dword [x]
+            size = types[words[0]]
+            text = words[1].strip()
+        if text in registers:
+            reg, rsize, special = registers[text]
+            return Operand('reg', reg, rsize, special)
+        if text.startswith('[') and text.endswith(']'):
+            base = None
+            index = None
+            rest = []
+            for sign, word in term.findall(text[1:-1]):
+                reg, _, scale = word.partition('*')
+                if scale or reg in registers and base is not None: # An index, like esi*4
+                    if index is not None or sign == '-' or reg not in registers or scale and int(scale) not in scales:
+                        raise Unsupported('Unsupported address %r' % text)
+                    index = registers[reg][:2] + (int(scale) if scale else 1,)
+                elif word in registers:
+                    if sign == '-':
+                        raise Unsupported('Unsupported address %r' % text)
+                    base = registers[word][:2]
+                else:
+                    rest.append(sign + word)
+            value, labelled = self.value(''.join(rest)) if rest else (0, False)
+            sizes = {reg[1] for reg in (base, index) if reg}
+            if len(sizes) > 1 or sizes - {self.bits // 8, 4} or index and index[0] == 4:
+                raise Unsupported('Unsupported address %r' % text)
+            return Operand('mem', size=size, base=base, index=index, value=value, labelled=labelled)
+        value, labelled = self.value(text)
+        return Operand('imm', size=size, value=value, labelled=labelled)
+    def modrm(self, reg, rm):
+        '''
+        The modrm method.
+        Encode the ModRM byte, and the SIB byte and displacement, of a register field and a register or memory
+        operand. Returns the REX bits and the bytes.
+        '''
+        if rm.kind == 'reg':
+            return rm.reg >> 3, bytes([0xc0 | (reg & 7) << 3 | rm.reg & 7])
+        x = 0
+        if rm.index is not None: # A SIB byte with the index, and with no base if there is none
+            index, size, scale = rm.index
+            x = index >> 3 << 1
+            if rm.base is None:
+                sib = bytes([scales[scale] << 6 | (index & 7) << 3 | 5])
+                return x, bytes([0x04 | (reg & 7) << 3]) + sib + self.immediate(rm.value, 4, True)
+        if rm.base is None: # An absolute address
+            if self.bits == 64: # Needs a SIB byte, mod 00 rm 101 is relative to rip in 64 bit code
+                return 0, bytes([0x04 | (reg & 7) << 3, 0x25]) + self.immediate(rm.value, 4, True)
+            return 0, bytes([0x05 | (reg & 7) << 3]) + self.immediate(rm.value, 4, True)
+        base, size = rm.base
+        if rm.value == 0 and not rm.labelled and base & 7 != 5:
+            mod, disp = 0, b''
+        elif -128 <= rm.value < 128 and not rm.labelled:
+            mod, disp = 1, self.immediate(rm.value, 1, True)
+        else:
+            mod, disp = 2, self.immediate(rm.value, 4, True)
+        if rm.index is not None:
+            sib = bytes([scales[scale] << 6 | (index & 7) << 3 | base & 7])
+            return x | base >> 3, bytes([mod << 6 | (reg & 7) << 3 | 4]) + sib + disp
+        sib = b'\x24' if base & 7 == 4 else b''
+        return base >> 3, bytes([mod << 6 | (reg & 7) << 3 | base & 7]) + sib + disp
+    def immediate(self, value, size, signed=False):
+        '''
+        The immediate method.
+        Encode a value in size bytes, if it fits.
+        '''
+        low = -(1 << (8 * size - 1))
+        high = (1 << (8 * size - 1)) if signed else (1 << 8 * size)
+        if not low <= value < high:
+            raise Unsupported('Value %d does not fit in %d bytes' % (value, size))
+        return (value & ((1 << 8 * size) - 1)).to_bytes(size, 'little')
+    def encode(self, size, opcode, reg, rm, imm=b'', operands=()):
+        '''
+        The encode method.
+        Encode an instruction with a ModRM operand, adding the operand size and REX prefixes it needs.
+        '''
+        b, body = self.modrm(reg, rm)
+        address = b''
+        if rm.kind == 'mem' and self.bits == 64 and any(r and r[1] == 4 for r in (rm.base, rm.index)):
+            address = b'\x67' # 32 bit registers in a 64 bit address
+        return address + self.prefix(size, (4 if reg >= 8 else 0) | b, operands) + bytes(opcode) + body + imm
+    def short(self, size, code, reg, operands):
+        '''
+        The short method.
+        Encode the opcode of an instruction with the register in the opcode, like push or mov r, imm.
+        '''
+        return self.prefix(size, reg.reg >> 3, operands) + bytes([code])
+    def prefix(self, size, rex, operands):
+        '''
+        The prefix method.
+        Get the operand size and REX prefixes of an instruction, rex holds its R, X and B bits.
+        '''
+        rex |= 8 if size == 8 else 0
+        prefix = b''
+        if rex or any(op.special == 'rex' for op in operands):
+            if self.bits != 64 or any(op.special == 'high' for op in operands):
+                raise Unsupported('Instruction needs 64 bit registers')
+            prefix = bytes([0x40 | rex])
+        if size == 2:
+            prefix = b'\x66' + prefix
+        return prefix
+    def size(self, *operands):
+        '''
+        The size method.
+        Get the operand size of an instruction from its registers and size keywords.
+        '''
+        sizes = {op.size for op in operands if op.kind != 'imm' and op.size}
+        if len(sizes) != 1:
+            raise Unsupported('Operation size not specified' if not sizes else 'Mismatched operand sizes')
+        size = sizes.pop()
+        if size == 8 and self.bits != 64:
+            raise Unsupported('Instruction needs 64 bit registers')
+        return size
+    def instruction(self, op, args, address):
+        '''
+        The instruction method.
+        Encode an instruction at an address.
+        '''
+        if op in plain and not args:
+            return plain[op]
+        if op in strings and not args or op == 'rep' and len(args) == 1 and args[0] in strings:
+            code, size = strings[args[0] if op == 'rep' else op]
+            if size == 8 and self.bits != 64:
+                raise Unsupported('Instruction needs 64 bit registers')
+            rep = b'\xf3' if op == 'rep' else b''
+            return (b'\x66' + rep if size == 2 else rep + self.prefix(size, 0, ())) + bytes([code])
+        if op in ('jmp', 'call') or op[:1] == 'j' and op[1:] in conditions:
+            if len(args) != 1:
+                raise Unsupported('Bad jump')
+            target, labelled = self.value(args[0])
+            if op == 'jmp':
+                code = b'\xe9'
+            elif op == 'call':
+                code = b'\xe8'
+            else:
+                code = bytes([0x0f, 0x80 + conditions[op[1:]]])
+            return code + self.immediate(target - (address + len(code) + 4) if self.symbols is not None else 0, 4, True)
+        ops = [self.operand(arg) for arg in args]
+        if op == 'int' and len(ops) == 1 and ops[0].kind == 'imm':
+            return b'\xcd' + self.immediate(ops[0].value, 1)
+        if op in ('push', 'pop') and len(ops) == 1 and ops[0].kind == 'reg':
+            reg = ops[0]
+            if reg.size != self.bits // 8:
+                raise Unsupported('Bad operand for %s' % op)
+            code = (0x50 if op == 'push' else 0x58) + (reg.reg & 7)
+            return self.short(4, code, reg, ops) # push and pop are always full size, they need no REX.W
+        if op == 'push' and len(ops) == 1 and ops[0].kind == 'imm':
+            if -128 <= ops[0].value < 128 and not ops[0].labelled:
+                return b'\x6a' + self.immediate(ops[0].value, 1, True)
+            return b'\x68' + self.immediate(ops[0].value, 4, True)
+        if len(ops) == 2:
+            return self.binary(op, ops)
+        if len(ops) == 1 and op in unary and ops[0].kind != 'imm':
+            size = self.size(ops[0])
+            code, digit = unary[op]
+            return self.encode(size, [code + (size != 1)], digit, ops[0], operands=ops)
+        raise Unsupported('Unsupported instruction %s' % op)
+    def binary(self, op, ops):
+        '''
+        The binary method.
+        Encode an instruction with two operands.
+        '''
+        dest, src = ops
+        if dest.kind == 'imm' or dest.kind == src.kind == 'mem':
+            raise Unsupported('Bad operands for %s' % op)
+        if op in ('movzx', 'movsx') and dest.kind == 'reg' and src.kind != 'imm':
+            if not src.size or src.size >= dest.size or src.size > 2:
+                raise Unsupported('Bad operands for %s' % op)
+            code = 0xb6 if op == 'movzx' else 0xbe
+            return self.encode(dest.size, [0x0f, code + (src.size == 2)], dest.reg, src, operands=ops)
+        if op == 'lea' and dest.kind == 'reg' and src.kind == 'mem' and dest.size != 1:
+            return self.encode(dest.size, [0x8d], dest.reg, src, operands=ops)
+        if op in shifts:
+            size = self.size(dest)
+            if src.kind == 'reg' and src.reg == 1 and src.size == 1: # By cl
+                return self.encode(size, [0xd2 + (size != 1)], shifts[op], dest, operands=ops)
+            if src.kind == 'imm' and not src.labelled:
+                if src.value == 1:
+                    return self.encode(size, [0xd0 + (size != 1)], shifts[op], dest, operands=ops)
+                return self.encode(size, [0xc0 + (size != 1)], shifts[op], dest, self.immediate(src.value, 1),
+                    operands=ops)
+            raise Unsupported('Bad operands for %s' % op)
+        size = self.size(dest, src)
+        wide = size != 1 # Opcodes for bigger operands are one more than for bytes
+        if src.kind == 'imm':
+            imm = min(size, 4) # 64 bit operations take 32 bit values, except mov to a register
+            if op == 'mov':
+                if dest.kind == 'reg' and (size != 8 or not src.labelled and not -(1 << 31) <= src.value < 1 << 31):
+                    code = (0xb0 if size == 1 else 0xb8) + (dest.reg & 7) # mov r, imm, with imm64 for 64 bits
+                    return self.short(size, code, dest, ops) + self.immediate(src.value, size)
+                return self.encode(size, [0xc6 + wide], 0, dest, self.immediate(src.value, imm, size == 8), ops)
+            if op == 'test':
+                return self.encode(size, [0xf6 + wide], 0, dest, self.immediate(src.value, imm, size == 8), ops)
+            if op in alu:
+                if wide and not src.labelled and -128 <= src.value < 128:
+                    return self.encode(size, [0x83], alu[op], dest, self.immediate(src.value, 1, True), ops)
+                return self.encode(size, [0x80 + wide], alu[op], dest, self.immediate(src.value, imm, size == 8), ops)
+            raise Unsupported('Bad operands for %s' % op)
+        if op == 'mov':
+            if src.kind == 'reg': # mov r/m, r
+                return self.encode(size, [0x88 + wide], src.reg, dest, operands=ops)
+            return self.encode(size, [0x8a + wide], dest.reg, src, operands=ops)
+        if op == 'test':
+            reg, rm = (src, dest) if src.kind == 'reg' else (dest, src)
+            return self.encode(size, [0x84 + wide], reg.reg, rm, operands=ops)
+        if op in alu:
+            if src.kind == 'reg': # op r/m, r
+                return self.encode(size, [alu[op] * 8 + wide], src.reg, dest, operands=ops)
+            return self.encode(size, [alu[op] * 8 + 2 + wide], dest.reg, src, operands=ops)
+        raise Unsupported('Unsupported instruction %s' % op)
+    def statements(self, text):
+        '''
+        The statements method.
+        Split code into (section, label, op, args) statements. Comments and directives that change nothing
+        are removed.
+        '''
+        out = []
+        section = '.text'
+        for code in text.split('\n'):
+            code = comment.match(code).group(0).strip()
+            label = None
+            m = line.match(code)
+            if m:
+                label, code = m.groups()
+            op, _, rest = code.partition(' ')
+            op = op.lower()
+            args = [arg.strip() for arg in part.findall(rest) if arg.strip()]
+            if op in ('section', 'segment'):
+                name, *attributes = args[0].split()
+                if name not in ('.text', '.data', '.bss'):
+                    raise Unsupported('Unknown section %s' % name)
+                for attribute in attributes: # Sections start on 16 byte boundaries, so smaller alignments hold
+                    key, _, value = attribute.partition('=')
+                    if key != 'align' or self.value(value)[0] > 16:
+                        raise Unsupported('Unsupported section attribute %s' % attribute)
+                section = name
+                op = ''
+            elif op == 'global':
+                op = ''
+            elif op == 'bits':
+                if args != [str(self.bits)]:
+                    raise Unsupported('Mixed %s and %d bit code' % (args[0], self.bits))
+                op = ''
+            if label is not None or op:
+                out.append((section, label, op, args))
+        return out
+    def statement(self, op, args, address):
+        '''
+        The statement method.
+        Encode an instruction or data directive at an address.
+        '''
+        if op in data:
+            out = b''
+            for arg in args:
+                if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in '\'"':
+                    string = arg[1:-1].encode()
+                    out += string + bytes(-len(string) % data[op]) # Strings are padded to whole units
+                else:
+                    out += self.immediate(self.value(arg)[0], data[op])
+            return out
+        return self.instruction(op, args, address)
+    def assemble(self, text):
+        '''
+        The assemble method.
+        Assemble code into its sections. Returns the text and data bytes, the size of the bss section and
+        the labels. The code is laid out once with every label at 0, then encoded with the real addresses.
+        '''
+        statements = self.statements(text)
+        sizes = {'.text':0, '.data':0, '.bss':0}
+        places = {} # Label names to (section, offset)
+        for section, label, op, args in statements:
+            if label is not None:
+                if not label.startswith('.'):
+                    self.scope = label
+                places[self.name(label)] = (section, sizes[section])
+            if op in reserve:
+                sizes[section] += reserve[op] * self.value(args[0])[0]
+            elif op:
+                if section == '.bss':
+                    raise Unsupported('Only reserve directives may be in .bss')
+                sizes[section] += len(self.statement(op, args, 0))
+        starts = layout(self.bits, sizes['.text'], sizes['.data'])
+        self.symbols = {name: starts[section] + offset for name, (section, offset) in places.items()}
+        self.scope = ''
+        code = {'.text':bytearray(), '.data':bytearray()}
+        for section, label, op, args in statements:
+            if label is not None and not label.startswith('.'):
+                self.scope = label
+            if op and op not in reserve:
+                code[section] += self.statement(op, args, starts[section] + len(code[section]))
+        if '_start' not in self.symbols:
+            raise Unsupported('No _start label')
+        return bytes(code['.text']), bytes(code['.data']), sizes['.bss'], self.symbols
+
+def align(value, size):
+    '''
+    align function.
+    Used for rounding a value up to a multiple of size.
+    '''
+    return (value + size - 1) // size * size
+
+def layout(bits, text, data):
+    '''
+    layout function.
+    Used for getting the addresses of the sections of an executable with text and data bytes. The headers and
+    the text are one segment, the data and bss are another, starting on a new page.
+    '''
+    base = bases[bits]
+    headers = (52 + 2 * 32) if bits == 32 else (64 + 2 * 56)
+    offset = align(headers + text, 16) # Where the data is in the file
+    start = base + align(headers + text, page) + offset % page
+    return {'.text':base + headers, '.data':start, '.bss':start + align(data, 16), 'offset':offset}
+
+def executable(bits, text, data, bss, entry):
+    '''
+    executable function.
+    Used for making a static ELF executable from its sections.
+    '''
+    base = bases[bits]
+    starts = layout(bits, len(text), len(data))
+    memory = starts['.bss'] - starts['.data'] + bss # The data segment, with the bss after the data
+    ident = b'\x7fELF' + bytes([1 if bits == 32 else 2, 1, 1, 0]) + bytes(8)
+    if bits == 32:
+        header = struct.pack('<16sHHIIIIIHHHHHH', ident, 2, 3, 1, entry, 52, 0, 0, 52, 32, 2, 40, 0, 0)
+        headers = [struct.pack('<IIIIIIII', 1, 0, base, base, starts['.text'] - base + len(text),
+            starts['.text'] - base + len(text), 5, page)]
+        headers.append(struct.pack('<IIIIIIII', 1, starts['offset'], starts['.data'], starts['.data'], len(data),
+            memory, 6, page))
+    else:
+        header = struct.pack('<16sHHIQQQIHHHHHH', ident, 2, 62, 1, entry, 64, 0, 0, 64, 56, 2, 64, 0, 0)
+        headers = [struct.pack('<IIQQQQQQ', 1, 5, 0, base, base, starts['.text'] - base + len(text),
+            starts['.text'] - base + len(text), page)]
+        headers.append(struct.pack('<IIQQQQQQ', 1, 6, starts['offset'], starts['.data'], starts['.data'], len(data),
+            memory, page))
+    image = header + b''.join(headers) + text
+    return image + bytes(starts['offset'] - len(image)) + data
+
+def external(text, path, bits):
+    '''
+    external function.
+    Used for assembling and linking code with nasm and ld, for code the built-in assembler cannot encode.
+    '''
+    with tempfile.TemporaryDirectory() as temp:
+        source = os.path.join(temp, 'code.asm')
+        obj = os.path.join(temp, 'code.o')
+        with open(source, 'w') as file:
+            file.write(text)
+        subprocess.run(['nasm', '-felf%d' % bits, '-o', obj, source], check=True)
+        subprocess.run(['ld'] + (['-m', 'elf_i386'] if bits == 32 else []) + ['-o', path, obj], check=True)
+
+def bits(text):
+    '''
+    bits function.
+    Used for finding if code is 32 or 64 bit code: it is 64 bit code if it names 64 bit registers.
+    '''
+    return 64 if wide.search(text) or re.search(r'^\s*bits\s+64', text, re.M) else 32
+
+def build(text, path):
+    '''
+    build function.
+    Used for making an executable from code. Returns whether the built-in assembler was used.
+    '''
+    width = bits(text)
+    try:
+        code, values, bss, symbols = Assembler(width).assemble(text)
+    except Unsupported:
+        external(text, path, width)
+        return False
+    with open(path, 'wb') as file:
+        file.write(executable(width, code, values, bss, symbols['_start']))
+    os.chmod(path, 0o755)
+    return True
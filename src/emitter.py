@@ -0,0 +1,60 @@
+import io
+
+'''
+emitter.py - assembly emitter
+This module holds the code while it is generated. Every line is an instruction object, with its label or its
+opcode and operands, so optimizer passes can work on it without parsing text. The code is written to the file
+in one go when it is done, or in pieces if it gets too big.
+'''
+
+class Instruction():
+    '''
+    The instruction object.
+    A line of code: a label, or an instruction with its operands. Lines with strings are never split, their
+    whole text is the opcode.
+    '''
+    __slots__ = ('indent', 'op', 'args', 'label', 'line')
+    def __init__(self, indent, op='', args=(), label=None, line=None):
+        self.indent = indent # The indentation level
+        self.op = op # The opcode, empty for labels
+        self.args = list(args) # The operands
+        self.label = label # The name of the label, if it is one
+        self.line = line # The text of the line, made when it is needed
+    def text(self):
+        '''
+        The text method.
+        Get the line of code, without its indentation.
+        '''
+        if self.line is None:
+            if self.label is not None:
+                self.line = self.label + ':'
+            elif self.args:
+                self.line = '%s %s' % (self.op, ', '.join(self.args))
+            else:
+                self.line = self.op
+        return self.line
+    def __eq__(self, other):
+        return isinstance(other, Instruction) and self.indent == other.indent and self.text() == other.text()
+    def __repr__(self):
+        return 'Instruction(%d, %r)' % (self.indent, self.text())
+
+def parse(indent, line):
+    '''
+    parse function.
+    Used for making an instruction from a line of code.
+    '''
+    if line.endswith(':') and ' ' not in line:
+        return Instruction(indent, label=line[:-1], line=line)
+    if '"' in line or "'" in line:
+        return Instruction(indent, line, line=line)
+    op, _, rest = line.partition(' ')
+    return Instruction(indent, op, [arg.strip() for arg in rest.split(',')] if rest else [], line=line)
+
+def write(file, code):
+    '''
+    write function.
+    Used for writing code to a file with a single write.
+    '''
+    buffer = io.StringIO()
+    buffer.writelines('\t' * ins.indent + ins.text() + '\n' for ins in code)
+    file.write(buffer.getvalue())
@@ -1,5 +1,6 @@
 import re
 import parser
+from array import array
 
 '''
 lexer.py - lexer
@@ -24,19 +25,124 @@ tokens = { # Regex to tag mappings
     r'\(':parser.LPAR,
     r'\)':parser.RPAR,
     r',':parser.COMMA,
+    r'\[':parser.LSQ,
+    r'\]':parser.RSQ,
 }
 
+rules = list(tokens.items()) # The token rules, in the order they are tried
+space = re.compile(r'[ \t]*') # Whitespace between tokens
+# The old lexer tried every rule once per pass over the code, in order, so after a match only the rules after
+# it were tried before starting again from the first one. To get the same tokens, we compile one alternation
+# for every rule the scan could resume from. Each rule gets a named group so we know which one matched.
+patterns = [
+    re.compile('|'.join('(?P<t%d>%s)' % (i, rules[i][0]) for i in range(start, len(rules))))
+    for start in range(len(rules))
+]
+
+def scan(lines):
+    '''
+    scan function.
+    Used for lexing code in a single pass. Takes the code, or any iterable of lines (like the preprocessor's
+    output), and yields (text, tag, line, column) tuples, with lines and columns starting at 1. Comments run
+    until the end of the line. Every line in the body of an asm block becomes one raw token.
+    '''
+    if isinstance(lines, str):
+        lines = lines.split('\n')
+    last = None # The tag of the last token
+    asm = False # Whether we are in an asm block
+    for line, code in enumerate(lines, 1):
+        pos = 0 # Offset into the line, we never slice it
+        if asm:
+            text = code.strip()
+            if text[:1] != '}': # Still in the block
+                if text and '}' not in text:
+                    yield (text, parser.RAW, line, code.index(text) + 1)
+                continue
+            asm = False # The block ended, lex the bracket normally
+            pos = code.index('}')
+        end = len(code)
+        while not asm:
+            pos = space.match(code, pos).end() # Skip the whitespace
+            if pos >= end or code[pos] == '#': # The line is done, or the rest is a comment
+                break
+            m = patterns[0].match(code, pos)
+            if not m: # Nothing matched - the old lexer would hang here
+                raise SyntaxError('Unknown character %r at line %d, column %d' % (code[pos], line, pos + 1))
+            while m: # Keep going with the rules after the one that matched, like the old lexer did
+                i = int(m.lastgroup[1:])
+                yield (m.group(), rules[i][1], line, pos + 1)
+                pos = m.end()
+                if rules[i][1] == parser.LBRACK and last == parser.ASM: # An asm block, ignore the rest of the line
+                    asm = True
+                last = rules[i][1]
+                if asm or i + 1 == len(rules) or pos >= end:
+                    break
+                m = patterns[i + 1].match(code, pos)
+
 def lex(code):
-    stream = []
-    i = 0
-    while code: # Repeat till all the code is gone - if there is a syntax error, we will hang
-        if code[0] == '#': # The line begins with a comment, so ignore it
-            return stream
-        while code[0] == ' ' or code[0] == '\t' or code[0] == '\n': # Remove all whitespace
-            code = code[1:]
-        for token in tokens: # Iterate over every token
-            m = re.match(token, code) # Check if the current token is a match
-            if m:
-                code = code[len(m.group(0)):] # It is, so remove the token and add the match to the stream
-                stream.append((m.group(0), tokens[token]))
-    return stream
+    '''
+    lex function.
+    Used for lexing a single line of code into a list of tokens.
+    '''
+    return list(scan(code))
+
+class Buffer():
+    '''
+    The token buffer object.
+    Used for lexing a whole file once, from a string or an iterable of lines. Tokens are stored in flat arrays, and the offset of the first token of
+    every line is kept so statements can be found by line. Like the old line splitting, empty lines are not
+    counted.
+    '''
+    def __init__(self, code):
+        if isinstance(code, str):
+            code = code.split('\n')
+        self.text = [] # Token texts
+        self.tags = [] # Token tags
+        self.line = array('L') # The source line of every token
+        self.col = array('L') # The source column of every token
+        self.numbers = array('L') # The source line of every line that is not empty
+        for text, tag, line, col in scan(self.count(code)):
+            self.text.append(text)
+            self.tags.append(tag)
+            self.line.append(line)
+            self.col.append(col)
+        self.lines = array('L') # Offset of the first token of every line, plus the end
+        i = 0
+        for number in self.numbers:
+            while i < len(self.line) and self.line[i] < number:
+                i += 1
+            self.lines.append(i)
+        self.lines.append(len(self.text))
+    def count(self, lines):
+        '''
+        The count method.
+        Pass lines through to the lexer, remembering which ones are not empty.
+        '''
+        for number, line in enumerate(lines, 1):
+            if line: # Skip empty lines
+                self.numbers.append(number)
+            yield line
+    def __len__(self):
+        return len(self.lines) - 1
+    def span(self, line):
+        '''
+        The span method.
+        Get the start and end offsets of the tokens on a line.
+        '''
+        if line >= len(self):
+            raise SyntaxError('Unexpected end of file, missing }')
+        return self.lines[line], self.lines[line + 1]
+    def stream(self, line):
+        '''
+        The stream method.
+        Get the text-tag pairs on a line, for parsing.
+        '''
+        a, b = self.span(line)
+        return list(zip(self.text[a:b], self.tags[a:b]))
+    def closes(self, line):
+        '''
+        The closes method.
+        Check if a line ends a block.
+        '''
+        a, b = self.span(line)
+        return a < b and self.tags[a] == parser.RBRACK
@@ -1,18 +1,225 @@
 #!/usr/bin/python3
 
-import parser
-import lexer
+import argparse
 import asm
+import cache
+import compiler
+import concurrent.futures
+import driver
+import elf
+import io
+import lexer
+import os
+import parser
+import peep
+import pre
+import stats
 import sys
-import re
+import time
+
+'''
+newt.py - the command line interface
+Compiles Newt files to nasm files next to them.
+'''
+
+def options(args):
+    '''
+    options function.
+    Used for getting the options that change the generated code from the arguments, for compiler.setup and cache
+    keys.
+    '''
+    return {name: getattr(args, name) for name in compiler.defaults}
+
+def build(path, args, store=None, profile=None):
+    '''
+    build function.
+    Used for compiling a file. If a cache is given, the preprocessed code is looked up in it first. If a profile
+    is given, the times and counts of the compile are added to it.
+    '''
+    out = os.path.splitext(path)[0] + '.asm'
+    if store is None: # No cache, so the lexer can read the preprocessed lines as they come
+        try:
+            with open(path) as file, open(out, 'w') as output:
+                env = asm.Env(output)
+                compiler.setup(env, options(args))
+                env.profile = profile
+                env.run(file)
+        except BaseException: # Do not leave half written code, it would look up to date
+            if os.path.exists(out):
+                os.remove(out)
+            raise
+    else:
+        cached(path, out, args, store, profile)
+    if args.elf: # Make the executable too
+        with open(out) as file:
+            elf.build(file.read(), os.path.splitext(path)[0])
+
+def cached(path, out, args, store, profile=None):
+    '''
+    cached function.
+    Used for compiling a file, looking its preprocessed code up in a cache first.
+    '''
+    with open(path) as file:
+        code = file.read()
+    lines = stats.stage(profile, 'pre', list, pre.stream(code, pre.Context(), path))
+    if profile:
+        profile.count('files', 1)
+        profile.count('lines', len(lines))
+    key = cache.key(lines, options(args))
+    text = store.get(key)
+    if text is None: # Not cached, compile it
+        file = io.StringIO()
+        tree = store.tree(cache.key(lines, None)) if args.cache_ast else None # The tree does not need the options
+        if tree is None:
+            tokens = stats.stage(profile, 'lex', lexer.Buffer, lines)
+            if profile:
+                profile.count('tokens', len(tokens.text))
+            tree = stats.stage(profile, 'parse', parser.program, tokens)
+            if args.cache_ast:
+                store.plant(cache.key(lines, None), tree)
+        env = asm.Env(file)
+        compiler.setup(env, options(args))
+        env.profile = profile
+        env.numbers = [number for number, line in enumerate(lines, 1) if line] # Like the lexer, for errors
+        if args.incremental: # Reuse the code of the statements that did not change
+            env.fragments = store.fragments(path)
+        stats.stage(profile, 'codegen', env.emit, tree)
+        if args.incremental:
+            store.keep(path, env.used)
+            if args.cache_stats:
+                print('incremental: %d statements reused, %d compiled' % (env.reused, env.compiled))
+        text = file.getvalue()
+        store.put(key, text)
+    with open(out, 'w') as file:
+        stats.stage(profile, 'write', file.write, text)
+
+def work(path, args):
+    '''
+    work function.
+    Used for compiling one file of a batch, in this process or in a worker process. Returns the path, the time
+    it took, the error, if there was one, and the profile of the compile, if it was measured.
+    '''
+    start = time.perf_counter()
+    store = cache.Cache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    profile = stats.Profile() if args.profile or args.stats else None
+    error = None
+    try:
+        build(path, args, store, profile)
+    except Exception as e: # Report the error with the file, and go on with the others
+        error = '%s: %s' % (type(e).__name__, e)
+    if store:
+        store.close()
+    return path, time.perf_counter() - start, error, profile
+
+def sources(paths):
+    '''
+    sources function.
+    Used for finding the files to compile. Directories are searched for .newt files, in a fixed order.
+    '''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.endswith('.newt'):
+                    yield os.path.join(root, name)
+
+def batch(files, args, profile=None):
+    '''
+    batch function.
+    Used for compiling many files with a pool of processes. Results are printed in the order of the files, then
+    the timings. The profiles of the files are added to profile. Returns the number of files that failed.
+    '''
+    start = time.perf_counter()
+    failed = 0
+    timings = []
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        for path, seconds, error, measured in pool.map(work, files, [args] * len(files)): # Results come in order
+            timings.append((path, seconds))
+            if profile and measured:
+                profile.merge(measured)
+            if error:
+                failed += 1
+                print('%s: %s' % (path, error), file=sys.stderr)
+    wall = time.perf_counter() - start
+    for path, seconds in timings:
+        print('%9.3fs  %s' % (seconds, path))
+    print('compiled %d files (%d failed) in %.3fs, %.3fs of compile time' % (
+        len(files), failed, wall, sum(seconds for path, seconds in timings)))
+    return failed
 
-if len(sys.argv) < 1:
-    raise ArgumentError('Newt needs a file to run!')
+def arguments(description, prog=None):
+    '''
+    arguments function.
+    Used for making an argument parser with the options for compiling.
+    '''
+    args = argparse.ArgumentParser(description=description, prog=prog)
+    args.add_argument('files', nargs='+', metavar='file', help='the files, or directories of files, to compile')
+    args.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help='how many files to compile at once (default: the number of cores)')
+    args.add_argument('-O', type=int, choices=sorted(peep.levels), default=0, help='the optimization level')
+    args.add_argument('--unroll', metavar='N', type=int, default=0,
+        help='unroll for loops with a known number of runs if they have at most N statements, with -O1 or more')
+    args.add_argument('--inline', metavar='N', type=int, default=4,
+        help='inline functions with at most N statements, with -O2 (default: %(default)s)')
+    args.add_argument('--disable', metavar='PASS', action='append', default=[], choices=list(peep.passes),
+        help='do not run an optimizer pass, can be given more than once')
+    args.add_argument('--call', choices=asm.conventions, default='memory',
+        help='how arguments are passed to functions: in variables, or in registers with 64-bit stack frames')
+    args.add_argument('--buffer', metavar='N', type=int, default=0,
+        help='write the code every N instructions instead of all at the end, unless it is optimized')
+    args.add_argument('--cache', metavar='DIR', help='store compiled code in DIR, and reuse it if nothing changed')
+    args.add_argument('--cache-size', metavar='MB', type=int, default=100, help='the most space the cache may use')
+    args.add_argument('--cache-ast', action='store_true', help='store the syntax trees in the cache too, so other options do not parse again')
+    args.add_argument('--incremental', action='store_true',
+        help='with --cache, only compile the statements that changed since the last compile')
+    args.add_argument('--cache-stats', action='store_true', help='print the cache statistics when done')
+    return args
 
-file = open(sys.argv[1], 'r')
-out = open(sys.argv[1].split('.')[0] + '.asm', 'w')
+def main():
+    '''
+    main function.
+    Used for running Newt from the command line. newt.py build compiles, assembles and links.
+    '''
+    if sys.argv[1:2] == ['build']:
+        args = arguments('Compile, assemble and link Newt code.', 'newt.py build')
+        args.add_argument('--assembler', metavar='CMD', default=driver.assembler,
+            help="the assembler command, with {asm}, {obj} and {bits}, or 'builtin' for the built-in assembler "
+            "(default: %(default)s)")
+        args.add_argument('--linker', metavar='CMD', default=driver.linker,
+            help='the linker command, with {obj}, {exe} and {emulation} (default: %(default)s)')
+        args.add_argument('--force', action='store_true', help='run every step, even if its output is up to date')
+        args.set_defaults(elf=False, profile=False, stats=None)
+        args = args.parse_args(sys.argv[2:])
+        failed = driver.build(list(sources(args.files)), args, work)
+        sys.exit(1 if failed else 0)
+    args = arguments('Compile Newt code to nasm assembly.')
+    args.add_argument('--elf', action='store_true',
+        help='also make an executable with the built-in assembler, or with nasm and ld if it cannot')
+    args.add_argument('--profile', action='store_true',
+        help='print how long every stage and kind of statement took, and how much code went through them')
+    args.add_argument('--stats', metavar='FILE', help='write the times and counts of the compile to FILE as JSON')
+    args = args.parse_args()
+    files = list(sources(args.files))
+    failed = 0
+    profile = stats.Profile() if args.profile or args.stats else None
+    if len(files) == 1: # Just one file, so compile it here and let errors through
+        store = cache.Cache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+        build(files[0], args, store, profile)
+        if store:
+            store.close()
+    else:
+        failed = batch(files, args, profile)
+    if args.profile:
+        print(profile.table())
+    if args.stats:
+        with open(args.stats, 'w') as file:
+            profile.json(file)
+    if args.cache and args.cache_stats:
+        print('cache: %(hits)d hits, %(misses)d misses, %(evictions)d evictions' % cache.Cache(args.cache).stats())
+    sys.exit(1 if failed else 0)
 
-env = asm.Env(out)
-env.run(file)
-out.close()
-file.close()
+if __name__ == '__main__':
+    main()
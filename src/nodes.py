@@ -0,0 +1,215 @@
+'''
+nodes.py - syntax tree nodes
+This module defines the nodes of the syntax tree the parser builds. Nodes only hold data, code is generated from
+them by the runners in asm.py.
+'''
+
+class Node():
+    '''
+    The node object.
+    The base of every statement. Stores the line the statement is on.
+    '''
+    __slots__ = ('line',)
+    def __init__(self, line):
+        self.line = line # The line of the statement
+    def fields(self):
+        '''
+        The fields method.
+        Get the names of all the fields of the node.
+        '''
+        return [name for cls in reversed(type(self).__mro__) for name in getattr(cls, '__slots__', ())]
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.fields()))
+
+class Block(Node):
+    '''
+    The block node.
+    The base of every statement with a body in brackets.
+    '''
+    __slots__ = ('body',)
+    def __init__(self, line):
+        Node.__init__(self, line)
+        self.body = [] # The statements in the block
+
+class Assign(Node):
+    '''
+    The assign node.
+    <type> <name> = <value | name>;
+    <name> = <value | name>;
+    '''
+    __slots__ = ('type', 'name', 'value')
+    def __init__(self, line, type, name, value):
+        Node.__init__(self, line)
+        self.type = type # The type, None if it is not given
+        self.name = name # The name
+        self.value = value # The value
+
+class Call(Node):
+    '''
+    The call node.
+    <name> (<args>);
+    '''
+    __slots__ = ('name', 'args')
+    def __init__(self, line, name, args):
+        Node.__init__(self, line)
+        self.name = name # The function to call
+        self.args = args # The arguments
+
+class Condition(Block):
+    '''
+    The condition node.
+    if (<value | name> <op> <value | name>) {
+        <code>
+    }
+    '''
+    __slots__ = ('a', 'op', 'b')
+    def __init__(self, line, a, op, b):
+        Block.__init__(self, line)
+        self.a = a # The first value
+        self.op = op # The operator
+        self.b = b # The second value
+
+class While(Condition):
+    '''
+    The while node.
+    while (<value | name> <op> <value | name>) {
+        <code>
+    }
+    '''
+    __slots__ = ()
+
+class For(Block):
+    '''
+    The for node.
+    for (<name>, <value | name>, <value | name>) {
+        <code>
+    }
+    '''
+    __slots__ = ('var', 'min', 'max')
+    def __init__(self, line, var, min, max):
+        Block.__init__(self, line)
+        self.var = var # The counter variable
+        self.min = min # The minimum
+        self.max = max # The maximum
+
+class Asm(Block):
+    '''
+    The asm node.
+    asm {
+        <assembly>
+    }
+    The body holds lines of assembly instead of statements.
+    '''
+    __slots__ = ()
+
+class Array(Node):
+    '''
+    The array node.
+    <type> <name>[<size>];
+    Elements are used as <name>[<value | name>], which is kept as a single word.
+    '''
+    __slots__ = ('type', 'name', 'size')
+    def __init__(self, line, type, name, size):
+        Node.__init__(self, line)
+        self.type = type # The type of the elements
+        self.name = name # The name
+        self.size = size # The number of elements
+
+class Goto(Node):
+    '''
+    The goto node.
+    goto <line | name>;
+    '''
+    __slots__ = ('target',)
+    def __init__(self, line, target):
+        Node.__init__(self, line)
+        self.target = target # The line to go to
+
+class Define(Block):
+    '''
+    The define node.
+    define [inline] <name> (<type> <name>, ...) {
+        <code>
+    }
+    '''
+    __slots__ = ('name', 'args', 'inline')
+    def __init__(self, line, name, args, inline=False):
+        Block.__init__(self, line)
+        self.name = name # The name of the function
+        self.args = args # (type, name) pairs
+        self.inline = inline # Whether its code should replace its calls, however long it is
+
+def key(value):
+    '''
+    key function.
+    Used for getting the contents of a node, or a list of them, as nested tuples. Lines are left out, so the same
+    statement on another line has the same key.
+    '''
+    if isinstance(value, Node):
+        return (type(value).__name__,) + tuple(key(getattr(value, name)) for name in value.fields() if name != 'line')
+    if isinstance(value, (list, tuple)):
+        return tuple(key(item) for item in value)
+    return value
+
+def element(word):
+    '''
+    element function.
+    Used for splitting an element of an array, like buf[i], into the array and the index. Returns None for
+    other words.
+    '''
+    if word[-1:] != ']' or word[:1] == '"' or '[' not in word:
+        return None
+    name, _, index = word[:-1].partition('[')
+    return name, index
+
+def words(value):
+    '''
+    words function.
+    Used for iterating over every string in a node, or a list of them, including the ones in nested statements.
+    The array and index of elements are strings of their own too.
+    '''
+    if isinstance(value, str):
+        yield value
+        if element(value):
+            yield from element(value)
+    elif isinstance(value, Node):
+        for name in value.fields():
+            if name != 'line':
+                yield from words(getattr(value, name))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from words(item)
+
+def walk(body):
+    '''
+    walk function.
+    Used for iterating over every statement in a list of them, including the ones in nested blocks.
+    '''
+    for node in body:
+        yield node
+        if isinstance(node, Block) and not isinstance(node, Asm):
+            yield from walk(node.body)
+
+def types(tree):
+    '''
+    types function.
+    Used for finding the type every variable in a syntax tree is first given.
+    '''
+    found = {}
+    for node in walk(tree):
+        if isinstance(node, Assign) and node.type:
+            found.setdefault(node.name, node.type)
+        elif isinstance(node, Define):
+            for type, name in node.args:
+                found.setdefault(name, type)
+    return found
+
+def clone(node, **fields):
+    '''
+    clone function.
+    Used for copying a node with some of its fields changed, so passes never change the tree they are given.
+    '''
+    new = object.__new__(type(node))
+    for name in node.fields():
+        setattr(new, name, fields[name] if name in fields else getattr(node, name))
+    return new
@@ -0,0 +1,545 @@
+import nodes
+import peep
+import regs
+
+'''
+opt.py - syntax tree optimizer
+This module finds variables whose values are known when the code is compiled, and uses them to remove if
+statements that always or never run, and to unroll small for loops. Passes never change the tree they are
+given, they return a new one. It also removes the functions that are never called and the variables that are
+never read, and puts the code of small functions in place of their calls.
+'''
+
+bits = {'byte':8, 'word':16, 'dword':32, 'qword':64} # The size of every type
+tests = { # Functions for every comparison operator
+    '==':lambda a, b: a == b,
+    '!=':lambda a, b: a != b,
+    '<':lambda a, b: a < b,
+    '>':lambda a, b: a > b,
+    '<=':lambda a, b: a <= b,
+    '>=':lambda a, b: a >= b,
+}
+stores = {'mov', 'lea'} # Instructions that only change their first operand, and not the flags
+escapes = {'lea', 'xchg', 'xadd', 'cmpxchg'} # Instructions that may change or take the address of every operand
+
+def literal(word):
+    '''
+    literal function.
+    Get the number a word stands for, or None if it is not a number.
+    '''
+    try:
+        if word[:2] in ('0x', '0b'):
+            return int(word, 0)
+        return int(word, 10)
+    except ValueError:
+        return None
+
+def fits(value, type):
+    '''
+    fits function.
+    Check if a value fits in a type, whether the comparison is signed or not.
+    '''
+    return type in bits and 0 <= value < 1 << (bits[type] - 1)
+
+def assigned(body):
+    '''
+    assigned function.
+    Find the variables a list of statements may change. Returns None if they may change any variable.
+    '''
+    found = set()
+    for node in nodes.walk(body):
+        if isinstance(node, nodes.Assign):
+            found.add(node.name)
+        elif isinstance(node, nodes.For):
+            found.add(node.var)
+        elif isinstance(node, nodes.Call) and node.name not in peep.reads:
+            found.update(node.args[:1]) # Only the first operand is changed
+        if regs.clobbers(node):
+            return None
+    return found
+
+def merge(known, other):
+    '''
+    merge function.
+    Keep only the values that are the same on two paths through the code.
+    '''
+    for var in list(known):
+        if other.get(var) != known[var]:
+            del known[var]
+
+class Fold():
+    '''
+    The fold object.
+    Used for constant propagation over a syntax tree. known always holds the values of the variables that are
+    known at the statement being folded.
+    '''
+    def __init__(self, tree, unroll=0):
+        self.types = nodes.types(tree) # The types of the variables
+        self.funcs = {node.name for node in nodes.walk(tree) if isinstance(node, nodes.Define)}
+        self.arrays = {node.name for node in nodes.walk(tree) if isinstance(node, nodes.Array)}
+        self.unroll = unroll # The most statements an unrolled for loop may have
+    def value(self, word, known, type=None):
+        '''
+        The value method.
+        Get the value of a variable or number, or None if it is not known or does not fit in its type.
+        '''
+        if word in self.types:
+            value = known.get(word)
+            type = self.types[word]
+        else:
+            value = literal(word)
+        if value is None or type and not fits(value, type):
+            return None
+        return value
+    def element(self, word, known):
+        '''
+        The element method.
+        Use the value of the index of an element of an array, if it is known.
+        '''
+        parts = nodes.element(word)
+        if parts is None or self.value(parts[1], known) is None:
+            return word
+        return '%s[%d]' % (parts[0], self.value(parts[1], known))
+    def test(self, node, known):
+        '''
+        The test method.
+        Get the result of the comparison of an if statement or while loop, or None if it is not known.
+        '''
+        a = self.value(node.a, known)
+        b = self.value(node.b, known, self.types.get(node.a))
+        if a is None or b is None or node.b in self.types: # A variable b is compared by its last value in the code
+            return None
+        return tests[node.op](a, b)
+    def forget(self, body, known):
+        '''
+        The forget method.
+        Forget the variables a list of statements may change.
+        '''
+        changed = assigned(body)
+        if changed is None:
+            known.clear()
+            return
+        for var in changed:
+            known.pop(var, None)
+    def body(self, body, known):
+        '''
+        The body method.
+        Fold a list of statements.
+        '''
+        out = []
+        for node in body:
+            out.extend(self.statement(node, known))
+        return out
+    def statement(self, node, known):
+        '''
+        The statement method.
+        Fold a statement. Returns the statements it becomes.
+        '''
+        if isinstance(node, nodes.Assign) and (node.name in self.arrays or nodes.element(node.name)):
+            known.pop(node.name, None) # Arrays are not followed, only their indexes
+            name, value = self.element(node.name, known), self.element(node.value, known)
+            if (name, value) != (node.name, node.value):
+                node = nodes.clone(node, name=name, value=value)
+            return [node]
+        if isinstance(node, nodes.Assign):
+            type = node.type or self.types.get(node.name)
+            value = self.value(node.value, known, type) if node.value[:1] != '"' else None
+            if value is None:
+                known.pop(node.name, None)
+                if nodes.element(node.value):
+                    node = nodes.clone(node, value=self.element(node.value, known))
+                return [node]
+            known[node.name] = value
+            if node.value in self.types: # Use the value, not the variable
+                return [nodes.clone(node, value=str(value))]
+            return [node]
+        if isinstance(node, nodes.Call):
+            if node.name in self.funcs or regs.clobbers(node):
+                known.clear()
+                return [node]
+            if node.name != 'lea': # Use the values of the operands that are only read, lea needs an address
+                args = node.args[:1] + [str(known[arg]) if arg in known else arg for arg in node.args[1:]]
+                args = [self.element(arg, known) for arg in args]
+                if args != node.args:
+                    node = nodes.clone(node, args=args)
+            self.forget([node], known)
+            return [node]
+        if isinstance(node, nodes.While): # The body always runs once, the condition is tested after it
+            inner = dict(known)
+            self.forget(node.body, inner)
+            body = self.body(node.body, inner)
+            if self.test(node, inner) is False: # It never loops, so it is just its body
+                return self.body(node.body, known)
+            known.clear()
+            known.update(inner)
+            return [nodes.clone(node, body=body)]
+        if isinstance(node, nodes.Condition):
+            result = self.test(node, known)
+            if result is True: # The code always runs
+                return self.body(node.body, known)
+            if result is False: # The code never runs
+                return []
+            a, b = self.element(node.a, known), self.element(node.b, known)
+            if (a, b) != (node.a, node.b):
+                node = nodes.clone(node, a=a, b=b)
+            inner = dict(known)
+            body = self.body(node.body, inner)
+            merge(known, inner)
+            return [nodes.clone(node, body=body)]
+        if isinstance(node, nodes.For):
+            return self.loop(node, known)
+        if isinstance(node, nodes.Define): # The body runs when the function is called, we know nothing then
+            return [nodes.clone(node, body=self.body(node.body, {}))]
+        if isinstance(node, nodes.Asm):
+            known.clear()
+        return [node]
+    def loop(self, node, known):
+        '''
+        The loop method.
+        Fold a for loop, and unroll it if it is small enough. Like while loops, the body always runs once.
+        '''
+        low = self.value(node.min, known, self.types.get(node.var))
+        high = self.value(node.max, known, self.types.get(node.var))
+        changed = assigned(node.body)
+        bounds = node.min not in self.types and node.max not in self.types # Variables are addresses here
+        if bounds and low is not None and high is not None and changed is not None and node.var not in changed:
+            count = max(1, high - low)
+            size = len(list(nodes.walk(node.body))) + 1
+            if count * size <= self.unroll and not any(isinstance(n, nodes.Goto) for n in nodes.walk(node.body)):
+                out = []
+                for i in range(low, low + count):
+                    out.extend(self.statement(nodes.Assign(node.line, None, node.var, str(i)), known))
+                    out.extend(self.body(node.body, known))
+                out.extend(self.statement(nodes.Assign(node.line, None, node.var, str(low + count)), known))
+                return out
+        inner = dict(known)
+        inner.pop(node.var, None)
+        self.forget(node.body, inner)
+        body = self.body(node.body, inner)
+        known.clear()
+        known.update(inner)
+        known.pop(node.var, None)
+        return [nodes.clone(node, body=body)]
+
+def fold(tree, unroll=0):
+    '''
+    fold function.
+    Used for constant propagation and folding over a syntax tree. For loops are unrolled if the unrolled code
+    has at most unroll statements. Code with goto is left alone, since it could go anywhere.
+    '''
+    if any(isinstance(node, nodes.Goto) for node in nodes.walk(tree)):
+        return tree
+    return Fold(tree, unroll).body(tree, {})
+
+def declarations(tree):
+    '''
+    declarations function.
+    Get the first assignment with a type of every variable, and the declaration of every array, so variables in
+    code that was folded away still get defined.
+    '''
+    found = {}
+    for node in nodes.walk(tree):
+        if isinstance(node, nodes.Assign) and node.type or isinstance(node, nodes.Array):
+            found.setdefault(node.name, node)
+    return list(found.values())
+
+def code(body):
+    '''
+    code function.
+    Used for iterating over every statement in a list of them, including the ones in nested blocks, but not the
+    ones in functions, which only run if they are called.
+    '''
+    for node in body:
+        if isinstance(node, nodes.Define):
+            continue
+        yield node
+        if isinstance(node, nodes.Block) and not isinstance(node, nodes.Asm):
+            yield from code(node.body)
+
+def target(word):
+    '''
+    target function.
+    Get the variable a word changes when it is stored to: the array of an element, or the word itself.
+    '''
+    parts = nodes.element(word)
+    return parts[0] if parts else word
+
+def index(word):
+    '''
+    index function.
+    Get the words read to find where a word is when it is stored to: the index of an element, or nothing.
+    '''
+    parts = nodes.element(word)
+    return [parts[1]] if parts else []
+
+def reads(node):
+    '''
+    reads function.
+    Get the words a statement reads: the variables it uses and the functions it calls, but not the variables it
+    only changes, or the statements in it. Words in assembly are all read, since we cannot tell. Elements of
+    arrays are read as the array and the index.
+    '''
+    if isinstance(node, nodes.Assign):
+        return index(node.name) + list(nodes.words(node.value))
+    if isinstance(node, nodes.Call):
+        if node.name in stores:
+            return index(node.args[0]) + list(nodes.words(node.args[1:])) if node.args else []
+        return [node.name] + list(nodes.words(node.args))
+    if isinstance(node, nodes.Asm):
+        return [word for line in node.body for word in peep.word.findall(line)]
+    if isinstance(node, nodes.Condition): # While loops too
+        return list(nodes.words([node.a, node.b])) # b is read when compiling, so its assignment must stay
+    if isinstance(node, nodes.For):
+        return [node.var, node.min, node.max]
+    if isinstance(node, nodes.Goto):
+        return [node.target]
+    return []
+
+def written(body, readers=()):
+    '''
+    written function.
+    Get the variables code may change: the ones it stores to, the first operand of an instruction, every operand
+    of an instruction that swaps or takes addresses, every argument of a function, since it may get the address,
+    and every word in assembly. Giving a variable a string does not store to it. Functions in readers never
+    change their arguments.
+    '''
+    funcs = {node.name for node in nodes.walk(body) if isinstance(node, nodes.Define)}
+    found = set()
+    for node in nodes.walk(body):
+        if isinstance(node, nodes.Assign) and node.value[:1] != '"':
+            found.add(target(node.name))
+        elif isinstance(node, nodes.Call) and node.name in readers:
+            continue
+        elif isinstance(node, nodes.Call) and (node.name in funcs or node.name in escapes):
+            found.update(target(arg) for arg in node.args)
+        elif isinstance(node, nodes.Call):
+            found.update(target(arg) for arg in node.args[:1])
+        elif isinstance(node, nodes.Asm):
+            found.update(reads(node))
+        elif isinstance(node, nodes.For):
+            found.add(node.var)
+    return found
+
+def used(tree):
+    '''
+    used function.
+    Find the functions that can be called, starting from the code outside of functions, and the words read by
+    the code that can run. Returns the names of the functions and the words.
+    '''
+    funcs = {}
+    for node in nodes.walk(tree):
+        if isinstance(node, nodes.Define):
+            funcs.setdefault(node.name, []).append(node)
+    called = set()
+    words = set()
+    todo = [tree]
+    while todo:
+        for node in code(todo.pop()):
+            for word in reads(node):
+                if word in funcs and word not in called: # Its code can run too
+                    called.add(word)
+                    todo.extend(define.body for define in funcs[word])
+                words.add(word)
+    return called, words
+
+class Prune():
+    '''
+    The prune object.
+    Used for removing the code that does nothing: functions that are never called, stores to variables that are
+    never read, and arguments that are never read.
+    '''
+    def __init__(self, tree):
+        self.called, self.words = used(tree)
+        self.vars = set(nodes.types(tree)) # The variables, every other name is a register or a label
+        self.vars.update(node.name for node in nodes.walk(tree) if isinstance(node, (nodes.Assign, nodes.Array)))
+        self.dropped = {} # Function names to the positions of the arguments they do not need
+        defines = [node for node in nodes.walk(tree) if isinstance(node, nodes.Define)]
+        calls = [node for node in nodes.walk(tree) if isinstance(node, nodes.Call)]
+        for define in defines:
+            if sum(node.name == define.name for node in defines) > 1: # We cannot tell which one is called
+                continue
+            if any(node.name == define.name and len(node.args) != len(define.args) for node in calls):
+                continue
+            unread = [i for i, (type, name) in enumerate(define.args) if name not in self.words]
+            if unread:
+                self.dropped[define.name] = unread
+    def dead(self, node):
+        '''
+        The dead method.
+        Check if a statement only stores to a variable that is never read, or defines a function that is never
+        called.
+        '''
+        if isinstance(node, nodes.Define):
+            return node.name not in self.called
+        if isinstance(node, (nodes.Assign, nodes.Array)):
+            return target(node.name) not in self.words
+        if isinstance(node, nodes.Call) and node.name in stores and node.args:
+            return target(node.args[0]) in self.vars and target(node.args[0]) not in self.words
+        return False
+    def body(self, body):
+        '''
+        The body method.
+        Prune a list of statements.
+        '''
+        out = []
+        for node in body:
+            if self.dead(node):
+                continue
+            if isinstance(node, nodes.Define) and node.name in self.dropped:
+                args = [arg for i, arg in enumerate(node.args) if i not in self.dropped[node.name]]
+                node = nodes.clone(node, args=args)
+            elif isinstance(node, nodes.Call) and node.name in self.dropped:
+                args = [arg for i, arg in enumerate(node.args) if i not in self.dropped[node.name]]
+                node = nodes.clone(node, args=args)
+            if isinstance(node, nodes.Block) and not isinstance(node, nodes.Asm):
+                node = nodes.clone(node, body=self.body(node.body))
+            out.append(node)
+        return out
+
+def prune(tree):
+    '''
+    prune function.
+    Used for removing dead code from a whole program. Removing code can make more code dead, like the stores to
+    a variable that was only read by a removed store, so it is pruned until nothing changes.
+    '''
+    while True:
+        pruned = Prune(tree).body(tree)
+        if nodes.key(pruned) == nodes.key(tree):
+            return pruned
+        tree = pruned
+
+def rename(value, names, line):
+    '''
+    rename function.
+    Used for copying statements with their variables renamed, and all of them moved to one line.
+    '''
+    if isinstance(value, list):
+        return [rename(node, names, line) for node in value]
+    fields = {'line':line}
+    for field in value.fields():
+        item = getattr(value, field)
+        if field == 'body':
+            fields[field] = rename(item, names, line)
+        elif field in ('line', 'type', 'op') or isinstance(value, nodes.Call) and field == 'name':
+            continue
+        elif isinstance(item, str):
+            fields[field] = renamed(item, names)
+        elif isinstance(item, list): # The arguments of a call
+            fields[field] = [renamed(word, names) for word in item]
+    return nodes.clone(value, **fields)
+
+def renamed(word, names):
+    '''
+    renamed function.
+    Get the new name of a word, or of the array and index of an element.
+    '''
+    parts = nodes.element(word)
+    if parts:
+        return '%s[%s]' % (names.get(parts[0], parts[0]), names.get(parts[1], parts[1]))
+    return names.get(word, word)
+
+class Inline():
+    '''
+    The inline object.
+    Used for replacing calls to small functions with their code, which saves the call, the return and passing
+    the arguments, and lets the values of the arguments be folded into the code.
+    '''
+    def __init__(self, tree, limit=0, rename=False):
+        names = [node.name for node in nodes.walk(tree) if isinstance(node, nodes.Define)]
+        self.funcs = {} # Names of the functions that can be inlined, to their definitions
+        for node in tree:
+            if not isinstance(node, nodes.Define) or names.count(node.name) > 1: # We cannot tell which one is called
+                continue
+            body = list(nodes.walk(node.body))
+            if any(isinstance(n, (nodes.Asm, nodes.Goto, nodes.Define)) for n in body): # It may return or jump
+                continue
+            if node.inline or len(body) <= limit:
+                self.funcs[node.name] = node
+        calls = {name: {n.name for n in nodes.walk(define.body) if isinstance(n, nodes.Call) and n.name in self.funcs}
+            for name, define in self.funcs.items()}
+        for name in list(calls): # Functions that can call themselves would never stop being inlined
+            todo, seen = list(calls[name]), set()
+            while todo:
+                other = todo.pop()
+                if other not in seen:
+                    seen.add(other)
+                    todo.extend(calls[other])
+            if name in seen:
+                del self.funcs[name]
+        self.pointers = {node.name for node in nodes.walk(tree)
+            if isinstance(node, nodes.Array) or isinstance(node, nodes.Assign) and node.value[:1] == '"'}
+        self.names = {} # Function names to the new names of their variables
+        if rename:
+            self.locals(tree)
+        self.bodies = {} # Function names to their code, with the calls in it inlined
+    def locals(self, tree):
+        '''
+        The locals method.
+        Give the arguments and local variables of every function a name of its own, like Define.locals finds
+        them. With the registers convention they live on the stack, so every copy of the code keeps them apart
+        from the variables of the code it is put in. Names never have digits, so the new ones are always free.
+        '''
+        for i, node in enumerate(tree):
+            if not isinstance(node, nodes.Define) or node.name not in self.funcs:
+                continue
+            outer = {n.name for n in code(tree[:i]) if isinstance(n, (nodes.Assign, nodes.Array)) and n.type}
+            outer.update(n.name for n in nodes.walk(tree[:i]) if isinstance(n, nodes.Assign) and n.value[:1] == '"')
+            found = [name for type, name in node.args]
+            for n in nodes.walk(node.body):
+                if isinstance(n, nodes.Assign) and n.type and n.value[:1] != '"' and n.name not in outer:
+                    found.append(n.name)
+            self.names[node.name] = {name: '%s_%d' % (name, len(self.names)) for name in found}
+    def body(self, name):
+        '''
+        The body method.
+        Get the code of a function, with the calls in it inlined.
+        '''
+        if name not in self.bodies:
+            self.bodies[name] = self.statements(self.funcs[name].body)
+        return self.bodies[name]
+    def fits(self, node):
+        '''
+        The fits method.
+        Check if a call can be inlined. Arrays and strings passed to arguments big enough for an address are
+        passed as their address, which an assignment would not do.
+        '''
+        define = self.funcs.get(node.name)
+        if define is None or len(node.args) != len(define.args):
+            return False
+        return not any(arg in self.pointers and bits[type] >= 32 for arg, (type, want) in zip(node.args, define.args))
+    def statements(self, body):
+        '''
+        The statements method.
+        Inline the calls in a list of statements. The arguments are assigned to the argument variables, then the
+        code of the function follows, on the line of the call.
+        '''
+        out = []
+        for node in body:
+            if isinstance(node, nodes.Call) and self.fits(node):
+                names = self.names.get(node.name, {})
+                for arg, (type, want) in zip(node.args, self.funcs[node.name].args):
+                    out.append(nodes.Assign(node.line, type, names.get(want, want), arg))
+                out.extend(rename(self.body(node.name), names, node.line))
+                continue
+            if isinstance(node, nodes.Block) and not isinstance(node, nodes.Asm):
+                node = nodes.clone(node, body=self.statements(node.body))
+            out.append(node)
+        return out
+
+def inline(tree, limit=0, rename=False):
+    '''
+    inline function.
+    Used for replacing calls to functions with their code. Functions with at most limit statements are inlined,
+    and the ones defined with define inline always are, unless they can call themselves or have assembly or
+    gotos. With rename, the variables of every function get names of their own, for the registers convention.
+    Functions that are no longer called are removed. Code with goto is left alone, like in fold.
+    '''
+    if any(isinstance(node, nodes.Goto) for node in nodes.walk(tree)):
+        return tree
+    inliner = Inline(tree, limit, rename)
+    if not inliner.funcs:
+        return tree
+    tree = inliner.statements(tree)
+    called = used(tree)[0]
+    return [node for node in tree if not isinstance(node, nodes.Define) or node.name in called
+        or node.name not in inliner.funcs]
@@ -1,4 +1,4 @@
-import copy
+import nodes
 
 '''
 parser.py - parser
@@ -22,198 +22,251 @@ OP = 'op'
 LPAR = '('
 RPAR = ')'
 COMMA = ','
+LSQ = '['
+RSQ = ']'
+RAW = 'raw' # A line of inline assembly
 
-def expect(stream, token):
+class Parser():
     '''
-    expect function.
-    Used when a token is manditory.
+    The parser object.
+    Used for parsing tokens from a token buffer. Tokens are never removed, we just move a cursor over them.
     '''
-    try:
-        if type(token) == str: # The token is a string
-            if stream[0][1] == token:
-                stream.pop(0) # Pop the token if we find a match
-                return True
-            raise SyntaxError('Invalid token %s' % stream[0][0]) # Raise an error otherwise
-        else: # The token is iterable, we never really use this
-            for t in token: # Iterate over every token
-                if stream[0][1] == t: # Match it
-                    stream.pop(0)
-                    return True
-            raise SyntaxError('Invalid token %s' % stream[0][0])
-    except IndexError:
-        raise SyntaxError('Not enough tokens') # There aren't enough tokens, yell at somebody
-def accept(stream, token):
-    '''
-    accept function.
-    Used for optional tokens or for accepting any of a set of tokens.
-    '''
-    if type(token) == str: # The token is a string
-        first = stream[0][1]
-        if first == token:
-            stream.pop(0) # Pop the token if we find a match
-            return True
-        return False # If no match was found, just return false
-    else: # The token is iterable, this is not really used
-        for t in token: # Iterate over every token
-            if stream[0][1] == t: # Match it
-                stream.pop(0)
-                return True
-        return False
-
-def assign(stream):
-    '''
-    assign function.
-    Used for parsing an assign statement.
-    '''
-    if len(stream) == 5: # The statement is of the form <type> <name> = <val>;
-        if accept(stream, TYPE):
-            expect(stream, NAME)
-            expect(stream, EQ)
-            accept(stream, VAL)
-            accept(stream, NAME)
-            expect(stream, SEMI)
-            return True
-    elif len(stream) == 4: # The statement is of the form <name> = <val>;
-        if accept(stream, NAME):
-            expect(stream, EQ)
-            accept(stream, VAL)
-            accept(stream, NAME)
-            expect(stream, SEMI)
-            return True
-    return False
-
-def arg(stream):
-    '''
-    arg function.
-    Not applied directly to lexed code - used for parsing arguments to functions.
-    '''
-    if accept(stream, TYPE) or accept(stream, VAL) or accept(stream, NAME): # We found a match
-        accept(stream, RPAR) # This could be the end of the stream
-        if len(stream) > 1: # But then again, it might not be
-            accept(stream, COMMA)
-            arg(stream)
-        return True
-    elif accept(stream, RPAR):
-        return True
-    return False
-def call(stream):
-    '''
-    call function.
-    Used for parsing function calls.
-    '''
-    if accept(stream, NAME):
-        expect(stream, LPAR)
-        arg(stream)
-        expect(stream, SEMI)
-        return True
-    return False
-
-def condition(stream):
-    '''
-    condition function.
-    Used for parsing if statements.
-    '''
-    if accept(stream, IF):
-        expect(stream, LPAR)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, OP)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, RPAR)
-        expect(stream, LBRACK)
-        return True
-    return False
-
-def asm(stream):
-    '''
-    asm function.
-    Used for parsing inline assembly.
-    '''
-    if accept(stream, ASM):
-        expect(stream, LBRACK)
-        return True
-    return False
-
-def loop(stream):
-    '''
-    loop function.
-    Used for parsing while loops.
-    '''
-    if accept(stream, WHILE):
-        expect(stream, LPAR)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, OP)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, RPAR)
-        expect(stream, LBRACK)
-        return True
-    return False
-
-def rep(stream):
-    '''
-    rep function.
-    Used for parsing for loops.
-    '''
-    if accept(stream, FOR):
-        expect(stream, LPAR)
-        expect(stream, NAME)
-        expect(stream, COMMA)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, COMMA)
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, RPAR)
-        expect(stream, LBRACK)
-        return True
-    return False
+    def __init__(self, tokens, start, end):
+        self.tokens = tokens # The token buffer
+        self.pos = start # The cursor
+        self.end = end # The end of the tokens we may use
+    def peek(self, ahead=0):
+        '''
+        The peek method.
+        Get the tag of a token after the cursor, or None if there are no more tokens.
+        '''
+        if self.pos + ahead < self.end:
+            return self.tokens.tags[self.pos + ahead]
+        return None
+    def error(self):
+        '''
+        The error method.
+        Get an error for the token at the cursor.
+        '''
+        if self.pos < self.end:
+            i = self.pos
+            return SyntaxError('Invalid token %s at line %d, column %d' % (
+                self.tokens.text[i], self.tokens.line[i], self.tokens.col[i]))
+        i = self.end - 1
+        return SyntaxError('Not enough tokens at line %d' % self.tokens.line[i]) # Yell at somebody
+    def expect(self, *tags):
+        '''
+        The expect method.
+        Used when a token is manditory. Returns its text.
+        '''
+        if self.peek() not in tags:
+            raise self.error()
+        self.pos += 1
+        return self.tokens.text[self.pos - 1]
+    def accept(self, *tags):
+        '''
+        The accept method.
+        Used for optional tokens. Returns the text, or None if there was no match.
+        '''
+        if self.peek() not in tags:
+            return None
+        self.pos += 1
+        return self.tokens.text[self.pos - 1]
+    def statement(self, line):
+        '''
+        The statement method.
+        Parse a statement, choosing the production from the first token.
+        '''
+        if self.peek() not in parsers:
+            raise self.error()
+        node = parsers[self.peek()](self, line)
+        if self.pos != self.end: # The whole line must be used
+            raise self.error()
+        return node
+    def name(self, line):
+        '''
+        name method.
+        A statement starting with a name is an assignment or a call, so look at the token after the name, or
+        after the array index.
+        '''
+        if self.peek(1) == EQ or self.peek(1) == LSQ and self.peek(4) == EQ:
+            return self.assign(line)
+        return self.call(line)
+    def value(self):
+        '''
+        value method.
+        Used for parsing a value, a name, or an element of an array like buf[i], which is kept as one word.
+        '''
+        value = self.expect(VAL, NAME)
+        if self.tokens.tags[self.pos - 1] == NAME and self.accept(LSQ):
+            value += '[%s]' % self.expect(VAL, NAME)
+            self.expect(RSQ)
+        return value
+    def assign(self, line):
+        '''
+        assign method.
+        Used for parsing an assign statement, or the declaration of an array.
+        '''
+        type = self.accept(TYPE)
+        if type and self.peek(1) == LSQ: # <type> <name>[<size>];
+            name = self.expect(NAME)
+            self.expect(LSQ)
+            size = self.expect(VAL)
+            self.expect(RSQ)
+            self.expect(SEMI)
+            return nodes.Array(line, type, name, size)
+        name = self.value() if not type else self.expect(NAME)
+        self.expect(EQ)
+        value = self.value()
+        self.expect(SEMI)
+        return nodes.Assign(line, type, name, value)
+    def args(self, arg):
+        '''
+        args method.
+        Used for parsing the arguments of calls and definitions, up to and including the closing parenthesis.
+        Each argument is parsed with the arg function.
+        '''
+        args = []
+        if self.accept(RPAR):
+            return args
+        args.append(arg())
+        while not self.accept(RPAR):
+            self.expect(COMMA)
+            args.append(arg())
+        return args
+    def call(self, line):
+        '''
+        call method.
+        Used for parsing function calls.
+        '''
+        name = self.expect(NAME)
+        self.expect(LPAR)
+        args = self.args(self.value)
+        self.expect(SEMI)
+        return nodes.Call(line, name, args)
+    def compare(self):
+        '''
+        compare method.
+        Used for parsing the (<a> <op> <b>) part of if statements and while loops.
+        '''
+        self.expect(LPAR)
+        a = self.value()
+        op = self.expect(OP)
+        b = self.value()
+        self.expect(RPAR)
+        self.expect(LBRACK)
+        return a, op, b
+    def condition(self, line):
+        '''
+        condition method.
+        Used for parsing if statements.
+        '''
+        self.expect(IF)
+        return nodes.Condition(line, *self.compare())
+    def loop(self, line):
+        '''
+        loop method.
+        Used for parsing while loops.
+        '''
+        self.expect(WHILE)
+        return nodes.While(line, *self.compare())
+    def rep(self, line):
+        '''
+        rep method.
+        Used for parsing for loops.
+        '''
+        self.expect(FOR)
+        self.expect(LPAR)
+        var = self.expect(NAME)
+        self.expect(COMMA)
+        min = self.expect(VAL, NAME)
+        self.expect(COMMA)
+        max = self.expect(VAL, NAME)
+        self.expect(RPAR)
+        self.expect(LBRACK)
+        return nodes.For(line, var, min, max)
+    def asm(self, line):
+        '''
+        asm method.
+        Used for parsing inline assembly.
+        '''
+        self.expect(ASM)
+        self.expect(LBRACK)
+        return nodes.Asm(line)
+    def goto(self, line):
+        '''
+        goto method.
+        Used for parsing goto statements.
+        '''
+        self.expect(GOTO)
+        target = self.expect(VAL, NAME)
+        self.expect(SEMI)
+        return nodes.Goto(line, target)
+    def define(self, line):
+        '''
+        define method.
+        Used for parsing function definitions.
+        '''
+        self.expect(DEFINE)
+        name = self.expect(NAME)
+        inline = name == 'inline' and self.peek() == NAME # A hint, not the name of the function
+        if inline:
+            name = self.expect(NAME)
+        self.expect(LPAR)
+        args = self.args(lambda: (self.expect(TYPE), self.expect(NAME)))
+        self.expect(LBRACK)
+        return nodes.Define(line, name, args, inline)
 
-def goto(stream):
-    '''
-    goto function.
-    Used for parsing goto statements.
-    '''
-    if accept(stream, GOTO):
-        accept(stream, VAL)
-        accept(stream, NAME)
-        expect(stream, SEMI)
+parsers = { # Leading tag to parser mappings
+    IF:Parser.condition,
+    WHILE:Parser.loop,
+    FOR:Parser.rep,
+    ASM:Parser.asm,
+    GOTO:Parser.goto,
+    DEFINE:Parser.define,
+    TYPE:Parser.assign,
+    NAME:Parser.name,
+}
 
-def define(stream):
+def parse(tokens, line):
     '''
-    define function.
-    Used for parsing function definitions.
+    The parse function - used for parsing the statement on a line of a token buffer.
     '''
-    if accept(stream, DEFINE):
-        expect(stream, NAME)
-        expect(stream, LPAR)
-        arg(stream)
-        expect(stream, LBRACK)
-        return True
-    return False
+    start, end = tokens.span(line)
+    return Parser(tokens, start, end).statement(line)
 
-def end(stream):
+def block(tokens, line, nested):
     '''
-    end function.
-    Never applied directly to input, used for checking if a statement just ended.
+    block function.
+    Used for parsing the statements from a line up to the closing bracket of a block, or the end of the file.
+    Returns the statements and the line after the block.
     '''
-    return stream.strip()[0] == '}'
+    body = []
+    while nested or line < len(tokens): # A block must be closed, span will complain if it is not
+        if tokens.closes(line):
+            if nested: # Our block ended
+                return body, line + 1
+            line += 1 # The line is a } outside of a block, skip it
+            continue
+        start, end = tokens.span(line)
+        if start == end: # Nothing but a comment
+            line += 1
+            continue
+        node = parse(tokens, line)
+        line += 1
+        if isinstance(node, nodes.Asm): # The lines of an asm block are raw assembly
+            while not tokens.closes(line):
+                start, end = tokens.span(line)
+                node.body.extend(tokens.text[start:end])
+                line += 1
+            line += 1
+        elif isinstance(node, nodes.Block):
+            node.body, line = block(tokens, line, True) # Parse the nested block
+        body.append(node)
+    return body, line
 
-parsers = [assign, call, condition, asm, loop, rep, goto, define] # The parsers
-def parse(stream):
+def program(tokens):
     '''
-    The parse function - used for parsing lexed code.
+    The program function - used for parsing a whole token buffer into a syntax tree.
     '''
-    i = 0
-    old = copy.copy(stream) # We need a copy of the stream because ours will be broken.
-    p = None
-    for parser in parsers: # Iterate over every parser
-        try:
-            parser(stream) # Apply the current parser to the input
-            if not stream:
-                p = parser # The whole stream was consumed, so this parser is the match
-        except Exception as e: # The parser threw and error, so pass over it
-            pass
-    return p, old
+    return block(tokens, 0, False)[0]
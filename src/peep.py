@@ -0,0 +1,213 @@
+import re
+import emitter
+
+'''
+peep.py - peephole optimizer
+This module improves the generated code by looking at a few instructions at a time. Code is a list of
+instruction objects, and every pass takes the list and returns a new one.
+'''
+
+inverse = { # The jump with the opposite condition of every conditional jump
+    'je':'jne', 'jne':'je', 'jz':'jnz', 'jnz':'jz',
+    'jl':'jge', 'jge':'jl', 'jg':'jle', 'jle':'jg',
+    'jb':'jae', 'jae':'jb', 'ja':'jbe', 'jbe':'ja',
+}
+writes = {'mov', 'inc', 'dec', 'add', 'sub', 'and', 'or', 'xor', 'not', 'neg', 'lea', 'shl', 'shr', 'sal', 'sar'}
+reads = {'cmp', 'test'} # Instructions that do not change their operands
+families = { # The registers that share bits
+    'al':'a', 'ah':'a', 'ax':'a', 'eax':'a', 'rax':'a',
+    'bl':'b', 'bh':'b', 'bx':'b', 'ebx':'b', 'rbx':'b',
+    'cl':'c', 'ch':'c', 'cx':'c', 'ecx':'c', 'rcx':'c',
+    'dl':'d', 'dh':'d', 'dx':'d', 'edx':'d', 'rdx':'d',
+    'sil':'si', 'si':'si', 'esi':'si', 'rsi':'si',
+    'dil':'di', 'di':'di', 'edi':'di', 'rdi':'di',
+}
+variable = re.compile(r'(?:(?:byte|word|dword|qword) )?\[([a-zA-Z_.][\w.]*|rbp[+-]\d+)\]$') # A [name] or stack operand
+word = re.compile(r'[a-zA-Z_.][\w.]*')
+
+def loads(code):
+    '''
+    loads pass.
+    Remove loads of values that are already in a register, and stores of values that are already in memory.
+    We remember which variable every register holds, and forget it when either of them changes.
+    '''
+    out = []
+    known = {} # Register family to the register and the variables it holds
+    for ins in code:
+        op, args = ins.op, ins.args
+        if ins.label is not None or op not in writes and op not in reads and not op.startswith('j'):
+            known = {} # Code can jump here, or we do not know what the instruction changes
+        elif op == 'mov' and len(args) == 2:
+            dest, src = args
+            m = variable.match(src)
+            if dest in families and m: # A load
+                if holds(known, dest, m.group(1)):
+                    continue # The register already holds the variable
+                known[families[dest]] = (dest, {m.group(1)})
+                out.append(ins)
+                continue
+            m = variable.match(dest)
+            if m and src in families: # A store
+                if holds(known, src, m.group(1)):
+                    continue # The variable already holds the register
+                forget(known, dest)
+                if known.get(families[src], (None,))[0] != src:
+                    known[families[src]] = (src, set())
+                known[families[src]][1].add(m.group(1))
+                out.append(ins)
+                continue
+            forget(known, dest)
+        elif op in writes and args:
+            forget(known, args[0])
+        elif op == 'jmp':
+            known = {}
+        out.append(ins)
+    return out
+
+def holds(known, reg, name):
+    '''
+    holds function.
+    Check if we know that a register holds a variable.
+    '''
+    entry = known.get(families[reg])
+    return entry is not None and entry[0] == reg and name in entry[1]
+
+def forget(known, dest):
+    '''
+    forget function.
+    Forget what we know about a register or variable that is written to.
+    '''
+    if dest in families:
+        known.pop(families[dest], None)
+        return
+    m = variable.match(dest)
+    for family, (reg, names) in known.items():
+        if not m: # Writes through pointers could change any variable
+            names.clear()
+        else:
+            names.discard(m.group(1))
+
+def targets(code):
+    '''
+    targets function.
+    Find where every label really goes: if the first instruction after it is a jmp, it goes where the jmp goes.
+    '''
+    jumps = {}
+    pending = []
+    for ins in code:
+        if ins.label is not None:
+            pending.append(ins.label)
+            continue
+        op, args = ins.op, ins.args
+        if op == 'nop':
+            continue
+        for name in pending:
+            if op == 'jmp' and len(args) == 1:
+                jumps[name] = args[0]
+        pending = []
+    return jumps
+
+def threading(code):
+    '''
+    threading pass.
+    Make jumps to a jmp go straight to where it goes.
+    '''
+    jumps = targets(code)
+    out = []
+    for ins in code:
+        op, args = ins.op, ins.args
+        if op.startswith('j') and len(args) == 1 and args[0] in jumps:
+            target = args[0]
+            seen = {target}
+            while target in jumps and jumps[target] not in seen: # Follow the chain, but not around a loop
+                target = jumps[target]
+                seen.add(target)
+            ins = emitter.Instruction(ins.indent, op, [target])
+        out.append(ins)
+    return out
+
+def branches(code):
+    '''
+    branches pass.
+    A conditional jump over a jmp, like
+        je a
+        jmp b
+    a:
+    becomes a single jump with the opposite condition.
+    '''
+    out = []
+    i = 0
+    while i < len(code):
+        op, args = code[i].op, code[i].args
+        if op in inverse and i + 2 < len(code) and len(args) == 1 and code[i + 2].label == args[0]:
+            op2, args2 = code[i + 1].op, code[i + 1].args
+            if op2 == 'jmp' and len(args2) == 1:
+                out.append(emitter.Instruction(code[i].indent, inverse[op], args2))
+                i += 2
+                continue
+        out.append(code[i])
+        i += 1
+    return out
+
+def nops(code):
+    '''
+    nops pass.
+    Remove nop instructions.
+    '''
+    return [ins for ins in code if ins.text() != 'nop']
+
+def following(code):
+    '''
+    following pass.
+    Remove jumps to the labels right after them.
+    '''
+    out = []
+    for i in range(len(code)):
+        op, args = code[i].op, code[i].args
+        if op.startswith('j') and len(args) == 1:
+            j = i + 1
+            while j < len(code) and code[j].label is not None and code[j].label != args[0]:
+                j += 1
+            if j < len(code) and code[j].label == args[0]:
+                continue
+        out.append(code[i])
+    return out
+
+def labels(code):
+    '''
+    labels pass.
+    Remove labels that nothing uses.
+    '''
+    used = set()
+    for ins in code:
+        if ins.label is None:
+            used.update(word.findall(ins.text()))
+    return [ins for ins in code if ins.label is None or ins.label in used]
+
+passes = { # Pass names to functions, in the order they are run
+    'loads':loads,
+    'threading':threading,
+    'branches':branches,
+    'nops':nops,
+    'following':following,
+    'labels':labels,
+}
+
+levels = { # The passes run at every optimization level
+    0:[],
+    1:list(passes),
+}
+levels[2] = levels[1] # Every pass already runs at -O1, -O2 only adds optimizations of the syntax tree and registers
+
+def optimize(code, names):
+    '''
+    optimize function.
+    Run passes over code until they do not change it any more.
+    '''
+    for i in range(10): # The passes help each other, but do not let them go on forever
+        old = code
+        for name in names:
+            code = passes[name](code)
+        if code == old:
+            break
+    return code
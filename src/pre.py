@@ -1,55 +1,164 @@
+import hashlib
+import os
 import re
 
 '''
 pre.py - preprocessor
-This module does basic preprocessing on Newt code.
+This module does basic preprocessing on Newt code. The code is read once, line by line, and the preprocessed
+lines are yielded as they are made, so the lexer can use them directly.
 '''
 
-macro = r'@[a-z]+ [^;]*;' # The format of a macro
-vars = {} # @defined variables
+macro = re.compile(r'@([a-z]+) ([^;]*);') # The format of a macro
+word = re.compile(r'"[^"]*"|#.*|\w+') # Things a variable could be replaced in - strings and comments are skipped
+files = {} # Included files that were already read, path to (mtime, hash, lines)
 
-def include(line, code, args):
+class Context():
+    '''
+    The context object.
+    Holds the state of one run of the preprocessor: the @defined variables, the files that were included, and
+    the include graph.
+    '''
+    def __init__(self, vars=None):
+        self.vars = {} if vars is None else vars # @defined variables
+        self.stack = [] # The files being included right now, used to find cycles
+        self.done = set() # The files that were included, every file is only included once
+        self.graph = {} # Which files every file includes
+    def enter(self, path):
+        '''
+        The enter method.
+        Start including a file. Returns False if it was already included.
+        '''
+        if path in self.stack: # The file includes itself, maybe through other files
+            chain = self.stack[self.stack.index(path):] + [path]
+            raise RecursionError('Circular @include: %s' % ' -> '.join(chain))
+        if self.stack and path not in self.graph[self.stack[-1]]:
+            self.graph[self.stack[-1]].append(path)
+        if path in self.done:
+            return False
+        self.done.add(path)
+        self.graph.setdefault(path, [])
+        self.stack.append(path)
+        return True
+    def leave(self):
+        '''
+        The leave method.
+        Finish including a file.
+        '''
+        self.stack.pop()
+
+def read(path):
+    '''
+    read function.
+    Used for reading a file into lines. Files are cached, and only read again if they changed.
+    '''
+    mtime = os.stat(path).st_mtime_ns
+    cached = files.get(path)
+    if cached and cached[0] == mtime: # The file was not touched
+        return cached[2]
+    with open(path) as file:
+        code = file.read()
+    digest = hashlib.sha1(code.encode()).hexdigest()
+    if cached and cached[1] == digest: # The file was touched, but it is the same
+        files[path] = (mtime, digest, cached[2])
+        return cached[2]
+    lines = code.split('\n')
+    files[path] = (mtime, digest, lines)
+    return lines
+
+def resolve(name, context):
+    '''
+    resolve function.
+    Used for finding an included file. Paths are relative to the including file first, then to the current
+    directory.
+    '''
+    if context.stack:
+        path = os.path.join(os.path.dirname(context.stack[-1]), name)
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return os.path.abspath(name)
+
+def substitute(text, vars):
+    '''
+    substitute function.
+    Used for replacing @defined variables in code. Only whole words are replaced, never parts of longer names
+    or numbers, and nothing in strings or comments.
+    '''
+    if not vars:
+        return text
+    return word.sub(lambda m: vars.get(m.group(0), m.group(0)), text)
+
+def include(args, context):
     '''
     include function.
-    Called when an @include macro is parsed.
+    Called when an @include macro is parsed. Yields the preprocessed lines of the file the user wants, unless
+    it was already included.
     '''
-    file = open(args[0]).read() # Open the file the user wants
-    code = code.replace(line, file) # Replace the macro with the file's contents
-    return code
+    path = resolve(args, context)
+    yield from stream(read(path), context, path)
 
-def define(line, code, args):
+def define(args, context):
     '''
     define function.
-    Called when an @define macro is parsed.
+    Called when an @define macro is parsed. The variable is replaced in all the code after it.
     '''
-    vars[args[0]] = args[1] # Add the variable to the dictionary
-    code = code.replace(line, '') # Remove the macro
-    lines = code.split('\n')
-    for i in range(len(lines)):
-        line = lines[i]
-        if line[0] != '@':
-            line = line.replace(args[0], args[1]) # Replace the variable with its value, except within other macros
-        lines[i] = line
-    code = '\n'.join(lines)
-    return code
+    name, _, value = args.partition(' ')
+    context.vars[name] = value.strip() # Add the variable to the dictionary
+    return ()
 
 funcs = { # String to function mappings
     'include':include,
     'define':define,
 }
 
-def pre(code):
+def stream(code, context, path=None):
+    '''
+    stream function.
+    Used for preprocessing code, given as a string or a list of lines, in a context. The path of the code is
+    used for finding included files. Yields the preprocessed lines.
+    '''
+    if isinstance(code, str):
+        code = code.split('\n')
+    if path:
+        path = os.path.abspath(path)
+        if not context.enter(path):
+            return
+    vars = context.vars
+    for line in code:
+        if '@' not in line: # No macros, so just replace variables
+            yield substitute(line, vars)
+            continue
+        out = ''
+        pos = 0
+        for m in macro.finditer(line):
+            out += substitute(line[pos:m.start()], vars) # The code before the macro
+            pos = m.end()
+            if m.group(1) in funcs: # The macro is one we know, so run it
+                lines = iter(funcs[m.group(1)](m.group(2).strip(), context))
+                for text in lines: # Its first line goes where the macro was, the others after it
+                    out += text
+                    break
+                for text in lines:
+                    yield out
+                    out = text
+            # The macro is unknown, so delete it
+        yield out + substitute(line[pos:], vars)
+    if path:
+        context.leave()
+
+def pre(code, path=None):
     '''
     pre function.
     Used for preprocessing code.
     '''
-    macs = re.findall(macro, code) # Find all macros
-    for mac in macs:
-        line = mac # Store the match
-        mac = mac[1:].rstrip(';') # Remove the semicolon
-        mac, args = mac.split()[0], mac.split()[1:] # Get the macro name and arguments
-        if mac in funcs:
-            code = funcs[mac](line, code, args) # The macro is one we know, so run it
-        else:
-            code = code.replace(line, '') # The macro is unknown, so delete it
-    return code
+    return '\n'.join(stream(code, Context(), path))
+
+def depends(path):
+    '''
+    depends function.
+    Used for getting the include graph of a file, so build tools know what to rebuild. Returns a dictionary of
+    every file to the files it includes.
+    '''
+    context = Context()
+    for line in stream(read(os.path.abspath(path)), context, path): # Preprocess the file to find the includes
+        pass
+    return context.graph
@@ -0,0 +1,106 @@
+import nodes
+import peep
+
+'''
+regs.py - register allocator
+This module chooses variables to keep in registers while loops run, so the loops do not go to memory every time
+around. It is a linear scan allocator: every loop is an interval, and the variables used most in it get the
+registers that are free for its whole body.
+'''
+
+families = ['b', 'c', 'd', 'si', 'di'] # The registers we may use, a is used by the code generator
+small = ['b', 'c', 'd'] # The registers that have byte parts
+safe = peep.writes | peep.reads | {'mov'} # Instructions that only change the registers they name
+names = { # The register of every family for every type
+    'byte':{'b':'bl', 'c':'cl', 'd':'dl'},
+    'word':{'b':'bx', 'c':'cx', 'd':'dx', 'si':'si', 'di':'di'},
+    'dword':{'b':'ebx', 'c':'ecx', 'd':'edx', 'si':'esi', 'di':'edi'},
+    'qword':{'b':'rbx', 'c':'rcx', 'd':'rdx', 'si':'rsi', 'di':'rdi'},
+}
+
+def register(family, type):
+    '''
+    register function.
+    Used for getting the register of a family for a type.
+    '''
+    return names[type][family]
+
+def clobbers(node):
+    '''
+    clobbers function.
+    Check if a statement may change registers it does not name, so variables in registers must be stored
+    before it and loaded after it. The functions the code defines are never safe.
+    '''
+    return isinstance(node, nodes.Asm) or isinstance(node, nodes.Call) and node.name not in safe
+
+def uses(node, counts):
+    '''
+    uses function.
+    Count how many times a statement uses every variable. Nested statements are counted by the caller.
+    '''
+    if isinstance(node, nodes.Assign):
+        words = [node.name, node.value]
+    elif isinstance(node, nodes.Call):
+        words = node.args
+    elif isinstance(node, nodes.Condition):
+        words = [node.a, node.b]
+    elif isinstance(node, nodes.For):
+        words = [node.var, node.var, node.var] # The counter is set, incremented and compared
+    else:
+        words = []
+    for word in words:
+        counts[word] = counts.get(word, 0) + 1
+        if nodes.element(word): # The index is read too
+            index = nodes.element(word)[1]
+            counts[index] = counts.get(index, 0) + 1
+
+def allocate(tree):
+    '''
+    allocate function.
+    Used for choosing registers for the loops in a syntax tree. Returns a dictionary of loops to dictionaries of
+    variables to register families.
+    '''
+    types = nodes.types(tree) # The type every variable is first given
+    # Registers the code names itself, anywhere and in asm too, may hold values it reads later or that a system
+    # call reads, and storing our variables only saves them, not what was in the register before
+    named = {peep.families[word] for text in nodes.words(tree) for word in peep.word.findall(text)
+        if word in peep.families}
+    arrays = {node.name for node in nodes.walk(tree) if isinstance(node, nodes.Array)}
+    intervals = [] # (start, -weight, end, variable, loop, blocked families)
+    order = list(nodes.walk(tree))
+    index = {id(node): i for i, node in enumerate(order)}
+    for node in order:
+        if not isinstance(node, (nodes.For, nodes.While)):
+            continue
+        body = list(nodes.walk(node.body))
+        if any(isinstance(n, (nodes.Define, nodes.Goto)) for n in body): # Too hard to follow, leave it in memory
+            continue
+        if any(isinstance(n, nodes.Asm) for n in body): # Its registers may be read by the code after it
+            continue
+        counts = {}
+        blocked = set(named)
+        for n in [node] + body:
+            uses(n, counts)
+            if isinstance(n, nodes.Assign) and n.name in arrays: # Filled or copied with rep stos or movs
+                blocked.update(('c', 'si', 'di'))
+            if any(nodes.element(word) for word in nodes.words(n)): # Indexes may be loaded into esi
+                blocked.add('si')
+        start = index[id(node)]
+        end = start + len(body)
+        for var, count in counts.items():
+            if var in types and (count >= 2 or isinstance(node, nodes.For) and var == node.var):
+                intervals.append((start, -count, end, var, node, blocked))
+    intervals.sort(key=lambda interval: interval[:2]) # Loops in order, the most used variables first
+    loops = {}
+    active = [] # (end, family, variable) of the intervals that hold registers
+    for start, weight, end, var, loop, blocked in intervals:
+        active = [interval for interval in active if interval[0] >= start] # Free the registers of loops that ended
+        if any(interval[2] == var for interval in active): # An outer loop already keeps it in a register
+            continue
+        taken = {interval[1] for interval in active} | blocked
+        free = [family for family in (small if types[var] == 'byte' else families) if family not in taken]
+        if not free: # No register for it, so it stays in memory
+            continue
+        loops.setdefault(loop, {})[var] = free[0]
+        active.append((end, free[0], var))
+    return loops
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+import argparse
+import cache
+import compiler
+import json
+import os
+import socketserver
+import stats
+import sys
+import threading
+import time
+
+'''
+server.py - the compile server
+This module keeps a compiler running, so editors and build tools do not pay for starting Python on every compile.
+It reads JSON-RPC 2.0 requests, one per line, from stdin or from a Unix socket, and answers each with one line.
+The compiled patterns, the included files and the compiled code stay in memory between requests.
+'''
+
+errors = { # JSON-RPC error codes
+    'parse':-32700, # The request is not JSON
+    'request':-32600, # The request is not a JSON-RPC request
+    'method':-32601, # There is no such method
+    'params':-32602, # The parameters are wrong
+    'internal':-32603, # The compiler failed, the code may be fine
+    'compile':-32000, # The code did not compile
+}
+
+class Failure(Exception):
+    '''
+    The failure object.
+    Raised by a method to answer with an error.
+    '''
+    def __init__(self, kind, message, data=None):
+        super().__init__(message)
+        self.code = errors[kind] # The JSON-RPC error code
+        self.data = data # More about the error, if there is more
+
+class Server():
+    '''
+    The server object.
+    Runs the requests. Compiles run one at a time, since they would only wait for each other anyway.
+    '''
+    def __init__(self, store):
+        self.store = store # Where compiled code is kept, a compiler.Memory or a cache.Cache
+        self.lock = threading.Lock() # Held while a request runs
+        self.started = time.time()
+        self.requests = 0 # Number of requests that were run
+        self.running = True # Cleared by the shutdown method
+        self.methods = { # Method names to the methods that run them
+            'compile':self.compile,
+            'stats':self.stats,
+            'shutdown':self.shutdown,
+        }
+    def compile(self, source=None, path=None, options=None, out=None, profile=False):
+        '''
+        The compile method.
+        Compile code given as source, or read from path. The code is written to out if it is given, otherwise
+        it is answered.
+        '''
+        if source is None:
+            if path is None:
+                raise Failure('params', 'Give the source or the path of the code')
+            try:
+                with open(path) as file:
+                    source = file.read()
+            except OSError as e:
+                raise Failure('params', str(e))
+        try:
+            options = compiler.settings(options)
+        except ValueError as e: # A bad option
+            raise Failure('params', str(e))
+        measured = stats.Profile() if profile else None
+        try:
+            result = compiler.compile(source, options, path, self.store, measured)
+        except Exception as e:
+            kind = 'compile' if isinstance(e, compiler.errors) else 'internal' # Only errors in the code are its fault
+            raise Failure(kind, '%s: %s' % (type(e).__name__, e), {'type':type(e).__name__, 'message':str(e)})
+        answer = {'deps':result.deps, 'cached':result.cached, 'seconds':result.seconds}
+        if out is None:
+            answer['code'] = result.code
+        else:
+            with open(out, 'w') as file:
+                file.write(result.code)
+        if measured:
+            answer['profile'] = measured.report()
+        return answer
+    def stats(self):
+        '''
+        The stats method.
+        Get how long the server has run, how many requests it ran, and the statistics of its cache.
+        '''
+        counts = self.store.stats()
+        if isinstance(self.store, cache.Cache): # It only stores the hits and misses of this run when it is closed
+            counts['hits'] += self.store.hits
+            counts['misses'] += self.store.misses
+        return {'uptime':time.time() - self.started, 'requests':self.requests, 'cache':counts}
+    def shutdown(self):
+        '''
+        The shutdown method.
+        Stop the server after answering.
+        '''
+        self.running = False
+        return None
+    def answer(self, line):
+        '''
+        The answer method.
+        Run a request given as a line of JSON. Returns the answer as a line of JSON, or None for notifications.
+        '''
+        id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                raise Failure('parse', str(e))
+            if not isinstance(request, dict) or request.get('jsonrpc') != '2.0' or 'method' not in request:
+                raise Failure('request', 'Not a JSON-RPC 2.0 request')
+            id = request.get('id')
+            method = self.methods.get(request['method'])
+            if method is None:
+                raise Failure('method', 'No method %r' % request['method'])
+            params = request.get('params', {})
+            with self.lock:
+                self.requests += 1
+                try:
+                    result = method(*params) if isinstance(params, list) else method(**params)
+                except TypeError as e: # The parameters do not fit the method
+                    raise Failure('params', str(e))
+            if 'id' not in request: # A notification, it is not answered
+                return None
+            reply = {'jsonrpc':'2.0', 'id':id, 'result':result}
+        except Failure as e:
+            error = {'code':e.code, 'message':str(e)}
+            if e.data is not None:
+                error['data'] = e.data
+            reply = {'jsonrpc':'2.0', 'id':id, 'error':error}
+        return json.dumps(reply) + '\n'
+    def serve(self, input, output):
+        '''
+        The serve method.
+        Answer the requests read from a file, one per line, until it ends or the server is shut down.
+        '''
+        for line in input:
+            if not line.strip():
+                continue
+            reply = self.answer(line)
+            if reply is not None:
+                output.write(reply)
+                output.flush()
+            if not self.running:
+                return
+
+class Handler(socketserver.StreamRequestHandler):
+    '''
+    The handler object.
+    Answers the requests of a connection to the socket.
+    '''
+    def handle(self):
+        server = self.server.newt
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = server.answer(line.decode())
+            if reply is not None:
+                self.wfile.write(reply.encode())
+                self.wfile.flush()
+            if not server.running: # Stop accepting connections, from another thread so this one can end
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+def listen(server, path):
+    '''
+    listen function.
+    Used for answering requests on a Unix socket, every connection in its own thread.
+    '''
+    if os.path.exists(path): # Left over from a server that did not stop cleanly
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as sock:
+        sock.daemon_threads = True
+        sock.newt = server
+        try:
+            sock.serve_forever()
+        finally:
+            os.remove(path)
+
+def main():
+    '''
+    main function.
+    Used for running the server from the command line.
+    '''
+    args = argparse.ArgumentParser(description='Compile Newt code for many requests, without starting again.')
+    args.add_argument('--socket', metavar='PATH', help='answer requests on a Unix socket instead of stdin')
+    args.add_argument('--cache', metavar='DIR', help='keep compiled code in DIR instead of only in memory')
+    args.add_argument('--cache-size', metavar='MB', type=int, default=100, help='the most space the cache may use')
+    args.add_argument('--memory', metavar='N', type=int, default=256,
+        help='the most compiled files to keep in memory, without --cache (default: %(default)s)')
+    args = args.parse_args()
+    if args.cache:
+        store = cache.Cache(args.cache, args.cache_size * 1024 * 1024)
+    else:
+        store = compiler.Memory(args.memory)
+    server = Server(store)
+    try:
+        if args.socket:
+            listen(server, args.socket)
+        else:
+            server.serve(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.cache:
+            store.close()
+
+if __name__ == '__main__':
+    main()
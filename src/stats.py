@@ -0,0 +1,137 @@
+import json
+import time
+
+'''
+stats.py - compile statistics
+This module measures where the time of a compile goes: how long every stage and every kind of statement took,
+how many times they ran, and how many lines, tokens and instructions went through. Hooks can be called before
+and after every stage.
+'''
+
+stages = ['pre', 'lex', 'parse', 'link', 'codegen', 'optimize', 'write'] # The stages, in the order they run
+counters = ['files', 'lines', 'tokens', 'statements', 'instructions'] # The things that are counted
+
+class Profile():
+    '''
+    The profile object.
+    Holds the times and counts of one or more compiles. The time of a stage or statement does not include the
+    time of the stages or statements inside it, so the times add up to the time of the compile.
+    '''
+    def __init__(self):
+        self.stages = {} # Stage names to their seconds and calls
+        self.kinds = {} # Statement kinds to their seconds and calls
+        self.counts = dict.fromkeys(counters, 0) # Counter names to their counts
+        self.hooks = {'before':{}, 'after':{}} # Stage names to the hooks called before and after them
+        self.inner = {'stages':0, 'kinds':0} # Time spent inside the stage or statement that is running
+    def before(self, stage, hook):
+        '''
+        The before method.
+        Call hook with the name of a stage before it runs.
+        '''
+        self.hooks['before'].setdefault(stage, []).append(hook)
+    def after(self, stage, hook):
+        '''
+        The after method.
+        Call hook with the name of a stage and what it returned after it runs.
+        '''
+        self.hooks['after'].setdefault(stage, []).append(hook)
+    def measure(self, table, name, function, *args):
+        '''
+        The measure method.
+        Call function with args, and add its time to an entry of a table, without the time of what was
+        measured inside it. Returns what function returned.
+        '''
+        outer = self.inner[table]
+        self.inner[table] = 0
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            seconds = time.perf_counter() - start
+            entry = getattr(self, table).setdefault(name, {'seconds':0, 'calls':0})
+            entry['seconds'] += seconds - self.inner[table]
+            entry['calls'] += 1
+            self.inner[table] = outer + seconds
+    def stage(self, name, function, *args):
+        '''
+        The stage method.
+        Run a stage with its hooks, and measure it.
+        '''
+        for hook in self.hooks['before'].get(name, []):
+            hook(name)
+        value = self.measure('stages', name, function, *args)
+        for hook in self.hooks['after'].get(name, []):
+            hook(name, value)
+        return value
+    def statement(self, kind, function, *args):
+        '''
+        The statement method.
+        Run the code generation of a statement, and measure it.
+        '''
+        self.counts['statements'] += 1
+        return self.measure('kinds', kind, function, *args)
+    def count(self, counter, n):
+        '''
+        The count method.
+        Add n to a counter.
+        '''
+        self.counts[counter] = self.counts.get(counter, 0) + n
+    def merge(self, other):
+        '''
+        The merge method.
+        Add the times and counts of another profile, like one made in a worker process.
+        '''
+        for table in ('stages', 'kinds'):
+            for name, entry in getattr(other, table).items():
+                mine = getattr(self, table).setdefault(name, {'seconds':0, 'calls':0})
+                mine['seconds'] += entry['seconds']
+                mine['calls'] += entry['calls']
+        for counter, n in other.counts.items():
+            self.count(counter, n)
+    def report(self):
+        '''
+        The report method.
+        Get the times and counts as a dictionary, ready to be written as JSON.
+        '''
+        order = sorted(self.stages, key=lambda name: stages.index(name) if name in stages else len(stages))
+        total = sum(entry['seconds'] for entry in self.stages.values())
+        return {
+            'stages':{name: dict(self.stages[name]) for name in order},
+            'kinds':{name: dict(self.kinds[name]) for name in sorted(self.kinds)},
+            'counts':dict(self.counts),
+            'total':total,
+            'lines_per_sec':self.counts['lines'] / total if total else 0,
+        }
+    def json(self, file):
+        '''
+        The json method.
+        Write the report to a file as JSON.
+        '''
+        json.dump(self.report(), file, indent=2)
+        file.write('\n')
+    def table(self):
+        '''
+        The table method.
+        Get the report as tables of text.
+        '''
+        report = self.report()
+        rows = []
+        for title, entries, total in (('stage', report['stages'], report['total']),
+            ('statement', report['kinds'], report['stages'].get('codegen', {}).get('seconds', 0))):
+            rows.append('%-12s %10s %8s %8s' % (title, 'seconds', '%', 'calls'))
+            for name, entry in entries.items():
+                share = entry['seconds'] / total * 100 if total else 0
+                rows.append('%-12s %10.4f %7.1f%% %8d' % (name, entry['seconds'], share, entry['calls']))
+            rows.append('')
+        rows.append('  '.join('%s: %d' % (counter, n) for counter, n in report['counts'].items()))
+        rows.append('%.4fs in total, %.0f lines/s' % (report['total'], report['lines_per_sec']))
+        return '\n'.join(rows)
+
+def stage(profile, name, function, *args):
+    '''
+    stage function.
+    Used for running a stage, measuring it if there is a profile.
+    '''
+    if profile is None:
+        return function(*args)
+    return profile.stage(name, function, *args)
@@ -0,0 +1,133 @@
+import hashlib
+import lexer
+import nodes
+import opt
+import os
+import parser
+import pre
+
+'''
+std.py - the standard library
+This module links the standard library into programs. The library is Newt code, with the work done in asm
+blocks, in the .newt files of the std directory. A program calls its functions like any other, and only the
+functions it calls, with the functions and variables they use, are added to its code.
+'''
+
+directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'std') # Where the library files are
+trees = {} # Library file paths to their lines and syntax tree, parsed again only when the file changes
+syscalls = [('int', ['0x80']), ('syscall', [])] # The calls that make system calls
+readers = {'print', 'print_char', 'print_int', 'strlen', 'exit'} # Functions that never change what they are given
+ends = {'print', 'strlen'} # Functions that look for the 0 at the end of the string they are given
+
+def paths():
+    '''
+    paths function.
+    Used for getting the paths of the library files, in order.
+    '''
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.newt')]
+
+def declaration(node):
+    '''
+    declaration function.
+    Check if a statement only declares a variable: it gives it a type, and a value it would have anyway.
+    '''
+    return isinstance(node, nodes.Assign) and node.type and (opt.literal(node.value) == 0 or node.value[:1] == '"')
+
+def load():
+    '''
+    load function.
+    Used for parsing the library. Returns its functions and its variables, by name. The library may only define
+    functions and variables, and its variables only start at 0 or hold strings, since no code sets them.
+    '''
+    funcs = {}
+    vars = {}
+    for path in paths():
+        lines = pre.read(path)
+        if path not in trees or trees[path][0] is not lines: # pre.read gives the same lines if nothing changed
+            trees[path] = (lines, parser.program(lexer.Buffer(lines)))
+        for node in trees[path][1]:
+            if isinstance(node, nodes.Define):
+                funcs[node.name] = node
+            elif isinstance(node, nodes.Array) or declaration(node):
+                vars[node.name] = node
+            else:
+                raise SyntaxError('%s: the standard library may only define functions and variables' % path)
+    return funcs, vars
+
+def digest():
+    '''
+    digest function.
+    Used for getting a hash of the library, so cached code is compiled again when it changes.
+    '''
+    digest = hashlib.sha1()
+    for path in paths():
+        for line in pre.read(path):
+            digest.update(line.encode())
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+def flushed(body):
+    '''
+    flushed function.
+    Used for adding a call to flush before every system call in a list of statements, so the buffered output
+    is written before the program writes anything itself, and before it exits.
+    '''
+    out = []
+    for node in body:
+        if isinstance(node, nodes.Call) and (node.name, list(node.args)) in syscalls:
+            out.append(nodes.Call(node.line, 'flush', []))
+        elif isinstance(node, nodes.Block) and not isinstance(node, nodes.Asm):
+            node = nodes.clone(node, body=flushed(node.body))
+        out.append(node)
+    return out
+
+def terminated(body):
+    '''
+    terminated function.
+    Used for finding the strings that must end with a 0: the ones given to a library function that looks for
+    the end, or to a function that passes its argument on to one. Other strings are written as they are.
+    '''
+    defines = {node.name: node for node in nodes.walk(body) if isinstance(node, nodes.Define)}
+    needs = {name: {0} for name in ends} # Function names to the positions of the arguments that need the 0
+    changed = True
+    while changed: # A function that passes an argument on needs it too, and so do the functions calling it
+        changed = False
+        for name, define in defines.items():
+            args = [arg for type, arg in define.args]
+            for node in nodes.walk(define.body):
+                if not isinstance(node, nodes.Call) or node.name not in needs:
+                    continue
+                for i in needs[node.name]:
+                    if i >= len(node.args) or node.args[i] not in args: # Not one of our arguments
+                        continue
+                    mine = needs.setdefault(name, set())
+                    if args.index(node.args[i]) not in mine:
+                        mine.add(args.index(node.args[i]))
+                        changed = True
+    return {node.args[i] for node in nodes.walk(body) if isinstance(node, nodes.Call) and node.name in needs
+        for i in needs[node.name] if i < len(node.args)}
+
+def link(tree):
+    '''
+    link function.
+    Used for finding the library functions a syntax tree calls, and everything they use. Functions the code
+    defines itself are not taken from the library. Returns the tree, the library variables and the library
+    functions. If the buffered output is used, the tree flushes it before its own system calls.
+    '''
+    defined = {node.name for node in nodes.walk(tree) if isinstance(node, nodes.Define)}
+    wanted = [node.name for node in nodes.walk(tree) if isinstance(node, nodes.Call) and node.name not in defined]
+    funcs, vars = load()
+    found = {}
+    while wanted:
+        name = wanted.pop()
+        if name in found or name not in funcs and name not in vars:
+            continue
+        found[name] = funcs.get(name) or vars[name]
+        if name in funcs: # It can use other functions and variables, even from asm blocks
+            wanted.extend(word for node in nodes.walk(funcs[name].body) for word in opt.reads(node))
+    if 'flush' in found:
+        tree = flushed(tree)
+    order = list(vars) + list(funcs) # Keep the order of the library, so the code is always the same
+    found = [found[name] for name in order if name in found]
+    defines = [node for node in found if isinstance(node, nodes.Define)]
+    return tree, [node for node in found if node not in defines], defines
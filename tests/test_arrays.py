@@ -0,0 +1,56 @@
+import platform
+import sys
+import unittest
+
+from test_calls import run
+
+'''
+test_arrays.py - array tests
+These tests compile programs that use elements of arrays with variable indexes, build them with the built-in
+assembler and check what they exit with. The indexes are set in assembly, so folding cannot make them constant.
+'''
+
+copy = '''
+dword buf[4];
+buf = 1;
+buf[2] = 9;
+dword i = 0;
+dword j = 0;
+asm {
+    mov dword [j], 2
+}
+buf[i] = buf[j];
+mov(edi, buf[0]);
+mov(eax, 60);
+syscall();
+'''
+
+widen = '''
+byte small[4];
+small = 200;
+dword i = 0;
+asm {
+    mov dword [i], 3
+}
+movzx(edi, small[i]);
+mov(eax, 60);
+syscall();
+'''
+
+@unittest.skipUnless(sys.platform.startswith('linux') and platform.machine() == 'x86_64', 'needs x86-64 Linux')
+class Elements(unittest.TestCase):
+    '''
+    The elements object.
+    Elements read and written in the same statement, and elements of other sizes than the register.
+    '''
+    def test_copy(self):
+        for level in (0, 1, 2):
+            with self.subTest(O=level):
+                self.assertEqual(run(copy, {'O':level}), 9)
+    def test_widen(self):
+        for level in (0, 1, 2):
+            with self.subTest(O=level):
+                self.assertEqual(run(widen, {'O':level}), 200)
+
+if __name__ == '__main__':
+    unittest.main()
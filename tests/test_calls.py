@@ -0,0 +1,61 @@
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import compiler
+import elf
+
+'''
+test_calls.py - function call tests
+These tests compile programs that call defined functions, build them with the built-in assembler and check what
+they exit with.
+'''
+
+elements = '''
+dword buf[4];
+buf = 7;
+buf[1] = 1;
+dword i = 1;
+dword j = 2;
+dword total = 0;
+define f(dword a, dword b, dword c) {
+    mov(eax, a);
+    add(eax, b);
+    add(eax, c);
+    mov(total, eax);
+}
+f(buf[i], 10, buf[j]);
+mov(edi, total);
+mov(eax, 60);
+syscall();
+'''
+
+def run(source, options):
+    '''
+    run function.
+    Used for compiling code, running it and getting its exit status.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'program')
+        elf.build(compiler.compile(source, options).code, path)
+        return subprocess.run([path]).returncode
+
+@unittest.skipUnless(sys.platform.startswith('linux') and platform.machine() == 'x86_64', 'needs x86-64 Linux')
+class Elements(unittest.TestCase):
+    '''
+    The elements object.
+    Elements of arrays with variable indexes passed as arguments, after other arguments.
+    '''
+    def test_conventions(self):
+        for call in ('memory', 'registers'):
+            for level in (0, 1, 2):
+                with self.subTest(call=call, O=level):
+                    self.assertEqual(run(elements, {'O':level, 'call':call}), 18)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import platform
+import sys
+import unittest
+
+from test_calls import run
+
+'''
+test_regs.py - register allocation tests
+These tests compile programs with loops at every level, build them with the built-in assembler and check what they
+exit with. At -O2 loop variables are kept in registers, which must not be ones the program uses itself.
+'''
+
+keep = '''
+dword i = 0;
+mov(ebx, 7);
+for (i, 0, 3) {
+    add(eax, 1);
+}
+mov(edi, ebx);
+mov(eax, 60);
+syscall();
+'''
+
+@unittest.skipUnless(sys.platform.startswith('linux') and platform.machine() == 'x86_64', 'needs x86-64 Linux')
+class Loops(unittest.TestCase):
+    '''
+    The loops object.
+    Registers set before a loop and read after it.
+    '''
+    def test_keep(self):
+        for level in (0, 1, 2):
+            with self.subTest(O=level):
+                self.assertEqual(run(keep, {'O':level}), 7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import compiler
+import server
+
+'''
+test_server.py - compile server tests
+These tests send requests to a server and check the errors it answers with: wrong code is the fault of the code,
+not of the compiler.
+'''
+
+def ask(source, options=None):
+    '''
+    ask function.
+    Used for sending a compile request for some code and getting the answer.
+    '''
+    params = {'source':source} if options is None else {'source':source, 'options':options}
+    request = {'jsonrpc':'2.0', 'id':1, 'method':'compile', 'params':params}
+    return json.loads(server.Server(compiler.Memory()).answer(json.dumps(request)))
+
+class Errors(unittest.TestCase):
+    '''
+    The errors object.
+    Code that names variables it never declared, at every level.
+    '''
+    def test_assign(self):
+        for level in (0, 1, 2):
+            with self.subTest(O=level):
+                error = ask('dword a = 1;\n\nx = 5;', {'O':level})['error']
+                self.assertEqual(error['code'], server.errors['compile'])
+                self.assertEqual(error['data'], {'type':'SyntaxError', 'message':'Unknown variable x at line 3'})
+    def test_for(self):
+        error = ask('for (i, 0, 3) {\n    nop();\n}')['error']
+        self.assertEqual(error['code'], -32000)
+        self.assertIn('Unknown variable i', error['message'])
+    def test_arguments(self):
+        error = ask('define f(dword a) {\n    nop();\n}\nf(1, 2);')['error']
+        self.assertEqual(error['code'], -32000)
+        self.assertIn('at line 4', error['message'])
+
+if __name__ == '__main__':
+    unittest.main()
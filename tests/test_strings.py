@@ -0,0 +1,40 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import compiler
+
+'''
+test_strings.py - string layout tests
+These tests check how strings are written to the data section: as they are, unless the library looks for their
+end.
+'''
+
+def data(source):
+    '''
+    data function.
+    Used for compiling code and getting the lines that define its strings.
+    '''
+    code = compiler.compile(source).code
+    section = code.split('section .data')[-1].split('section .bss')[0]
+    return [line.strip() for line in section.splitlines() if ' d' in line]
+
+class Terminators(unittest.TestCase):
+    '''
+    The terminators object.
+    Strings only end with a 0 when print or strlen need it.
+    '''
+    def test_plain(self):
+        self.assertEqual(data('byte s = "hi";\nbyte t = "there";\nmov(al, s);\nmov(bl, t);'),
+            ['s: db "hi"', 't: db "there"'])
+    def test_library(self):
+        self.assertEqual(data('byte s = "hi";\nbyte t = "there";\nprint(s);\nmov(bl, t);'),
+            ['s: db "hi", 0', 't: db "there"'])
+    def test_passed_on(self):
+        source = 'byte s = "hi";\ndefine say(dword a, dword b) {\n    print(b);\n}\nsay(0, s);'
+        self.assertIn('s: db "hi", 0', data(source))
+
+if __name__ == '__main__':
+    unittest.main()